@@ -0,0 +1,18 @@
+from rest_framework.authentication import TokenAuthentication
+
+from . import cache
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication без запроса к authtoken_token на каждый
+    запрос: пользователь берется из cache.tokens. request.auth -
+    несохраняемый токен с тем же ключом, без даты создания.
+    """
+
+    def authenticate_credentials(self, key):
+        user = cache.tokens.get(key, self.load_user)
+        return user, self.get_model()(key=key, user=user)
+
+    def load_user(self, key):
+        return super().authenticate_credentials(key)[0]
@@ -0,0 +1,260 @@
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache as shared_cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from recipes.models import (Favorite, Ingredient, IngredientAmountRecipe,
+                            Recipe, ShopingCart, ShoppingCartTotal, Tag,
+                            TimelineEntry)
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import Follow, User
+
+from . import cache
+
+SIZES = {
+    'users': 2000,
+    'tags': 6,
+    'ingredients': 2000,
+    'recipes': 5000,
+    'ingredients_per_recipe': 8,
+    'follows_per_user': 20,
+    'favorites_per_user': 20,
+    'carts_per_user': 5,
+}
+PAGE_SIZES = (6, 25, 100)
+BATCH_SIZE = 2000
+
+
+def scaled(scale):
+    """Размеры набора данных с учетом масштаба."""
+    return {
+        name: max(1, int(size * scale)) if name in (
+            'users', 'ingredients', 'recipes') else size
+        for name, size in SIZES.items()
+    }
+
+
+def seed(sizes, seed_value=0):
+    """
+    Заполняет базу правдоподобными данными:
+    пользователи, теги, ингредиенты, рецепты, подписки,
+    избранное и списки покупок.
+    """
+    rand = random.Random(seed_value)
+    password = make_password('benchmark-password')
+    User.objects.bulk_create(
+        (User(username=f'user{i}', email=f'user{i}@example.com',
+              first_name=f'Имя {i}', last_name=f'Фамилия {i}',
+              password=password)
+         for i in range(sizes['users'])),
+        batch_size=BATCH_SIZE
+    )
+    users = list(User.objects.values_list('id', flat=True))
+    Tag.objects.bulk_create(
+        Tag(name=f'Тег {i}', color=f'#{i:06x}', slug=f'tag{i}')
+        for i in range(sizes['tags'])
+    )
+    tags = list(Tag.objects.values_list('id', flat=True))
+    Ingredient.objects.bulk_create(
+        (Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+         for i in range(sizes['ingredients'])),
+        batch_size=BATCH_SIZE
+    )
+    ingredients = list(Ingredient.objects.values_list('id', flat=True))
+    Recipe.objects.bulk_create(
+        (Recipe(author_id=rand.choice(users), name=f'Рецепт {i}',
+                image='recipe/benchmark.png', text='Описание ' * 20,
+                cooking_time=rand.randint(5, 120))
+         for i in range(sizes['recipes'])),
+        batch_size=BATCH_SIZE
+    )
+    recipes = list(Recipe.objects.values_list('id', flat=True))
+    Recipe.tags.through.objects.bulk_create(
+        (Recipe.tags.through(recipe_id=recipe, tag_id=tag)
+         for recipe in recipes for tag in rand.sample(tags, 2)),
+        batch_size=BATCH_SIZE
+    )
+    IngredientAmountRecipe.objects.bulk_create(
+        (IngredientAmountRecipe(recipe_id=recipe, ingredient_id=ingredient,
+                                amount=rand.randint(1, 500))
+         for recipe in recipes
+         for ingredient in rand.sample(
+             ingredients, sizes['ingredients_per_recipe'])),
+        batch_size=BATCH_SIZE
+    )
+    for model, field, per_user, targets in (
+        (Follow, 'following_id', sizes['follows_per_user'], users),
+        (Favorite, 'recipe_id', sizes['favorites_per_user'], recipes),
+        (ShopingCart, 'recipe_id', sizes['carts_per_user'], recipes),
+    ):
+        model.objects.bulk_create(
+            (model(user_id=user, **{field: target})
+             for user in users
+             for target in rand.sample(targets, min(per_user, len(targets)))
+             if target != user or model is not Follow),
+            batch_size=BATCH_SIZE
+        )
+    ShoppingCartTotal.objects.rebuild()
+    Recipe.objects.reconcile_counters()
+    TimelineEntry.objects.rebuild()
+    cache.tags.invalidate()
+    cache.ingredients.invalidate()
+
+
+def endpoints(user, recipe, author, ingredient, tag):
+    """
+    Эндпоинты из api/urls.py: имя, метод, адрес, нужна ли
+    авторизация и зависит ли ответ от размера страницы.
+    """
+    return (
+        ('tags-list', 'get', '/api/tags/', False, False),
+        ('tags-detail', 'get', f'/api/tags/{tag}/', False, False),
+        ('ingredients-list', 'get', '/api/ingredients/', False, False),
+        ('ingredients-search', 'get', '/api/ingredients/?name=ингр',
+         False, False),
+        ('ingredients-detail', 'get', f'/api/ingredients/{ingredient}/',
+         False, False),
+        ('recipes-list', 'get', '/api/recipes/?limit={limit}', False, True),
+        ('recipes-list', 'get', '/api/recipes/?limit={limit}', True, True),
+        ('recipes-list-tags', 'get',
+         '/api/recipes/?limit={limit}&tags=tag0&tags=tag1', True, True),
+        ('recipes-list-favorited', 'get',
+         '/api/recipes/?limit={limit}&is_favorited=1', True, True),
+        ('recipes-feed', 'get', '/api/recipes/feed/?limit={limit}',
+         True, True),
+        ('recipes-detail', 'get', f'/api/recipes/{recipe}/', True, False),
+        ('recipes-download-shopping-cart', 'get',
+         '/api/recipes/download_shopping_cart/', True, False),
+        ('recipes-favorite', 'post', f'/api/recipes/{recipe}/favorite/',
+         True, False),
+        ('recipes-favorite', 'delete', f'/api/recipes/{recipe}/favorite/',
+         True, False),
+        ('recipes-shopping-cart', 'post',
+         f'/api/recipes/{recipe}/shopping_cart/', True, False),
+        ('recipes-shopping-cart', 'delete',
+         f'/api/recipes/{recipe}/shopping_cart/', True, False),
+        ('users-list', 'get', '/api/users/?limit={limit}', True, True),
+        ('users-me', 'get', '/api/users/me/', True, False),
+        ('users-subscriptions', 'get',
+         '/api/users/subscriptions/?limit={limit}&recipes_limit=3',
+         True, True),
+        ('users-subscribe', 'post', f'/api/users/{author}/subscribe/',
+         True, False),
+        ('users-subscribe', 'delete', f'/api/users/{author}/subscribe/',
+         True, False),
+    )
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[round((len(ordered) - 1) * fraction)]
+
+
+def reset_caches():
+    """
+    Очищает общий кэш и сбрасывает справочники и токены в памяти
+    процесса: иначе они замечают очистку только через
+    check_interval, и число запросов зависит от времени.
+    """
+    shared_cache.clear()
+    cache.tags.invalidate()
+    cache.ingredients.invalidate()
+    cache.tokens.invalidate()
+
+
+def measure(client, method, url, repeat):
+    """
+    Количество запросов к БД с пустым кэшем и с заполненным,
+    время ответа и пиковая память.
+    Перед замером GET выполняется один прогревочный запрос,
+    затем все кэши очищаются.
+    Запросы на изменение выполняются один раз.
+    """
+    def request():
+        response = getattr(client, method)(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    if method == 'get':
+        request()
+    reset_caches()
+    with CaptureQueriesContext(connection) as queries:
+        response = request()
+    query_count = len(queries)
+    warm_count = None
+    timings = []
+    peak = None
+    if method == 'get':
+        with CaptureQueriesContext(connection) as queries:
+            request()
+        warm_count = len(queries)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            request()
+            timings.append((time.perf_counter() - start) * 1000)
+        tracemalloc.start()
+        request()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        'status': response.status_code,
+        'queries': query_count,
+        'queries_warm': warm_count,
+        'p50_ms': (
+            round(statistics.median(timings), 2) if timings else None),
+        'p95_ms': (
+            round(percentile(timings, 0.95), 2) if timings else None),
+        'peak_memory_kb': round(peak / 1024, 1) if peak else None,
+    }
+
+
+def prepare():
+    """
+    Клиенты без авторизации и с токеном пользователя
+    с подписками и эндпоинты для него.
+    """
+    user = Follow.objects.values_list('user', flat=True).first()
+    author = User.objects.exclude(pk=user).exclude(
+        following__user=user).values_list('id', flat=True).first()
+    recipe = Recipe.objects.exclude(favorites__user=user).exclude(
+        shopping_cart__user=user).values_list('id', flat=True).first()
+    anonymous = APIClient()
+    client = APIClient()
+    client.credentials(
+        HTTP_AUTHORIZATION='Token ' + Token.objects.get_or_create(
+            user_id=user)[0].key)
+    return anonymous, client, endpoints(
+        user, recipe, author,
+        Ingredient.objects.values_list('id', flat=True).first(),
+        Tag.objects.values_list('id', flat=True).first())
+
+
+def run(repeat, page_sizes=PAGE_SIZES):
+    """Прогон всех эндпоинтов; возвращает результаты и ошибки."""
+    anonymous, client, urls = prepare()
+    results = []
+    failures = []
+    for name, method, url, auth, paginated in urls:
+        counts = []
+        for limit in page_sizes if paginated else (None,):
+            result = measure(
+                client if auth else anonymous, method,
+                url.format(limit=limit), repeat)
+            result.update({
+                'endpoint': name, 'method': method.upper(),
+                'authenticated': auth, 'page_size': limit,
+                'url': url.format(limit=limit),
+            })
+            results.append(result)
+            counts.append(result['queries'])
+        if counts[-1] > counts[0]:
+            failures.append(
+                f'{method.upper()} {name}: число запросов растет с размером '
+                f'страницы ({" -> ".join(map(str, counts))})')
+    return results, failures
@@ -0,0 +1,347 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from hashlib import md5, sha256
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from recipes.models import Favorite, Ingredient, ShopingCart, Tag
+from rest_framework.renderers import JSONRenderer
+from users.models import Follow, User
+
+from . import metrics, replicas
+
+
+class ReferenceCache:
+    """
+    Справочник в памяти процесса.
+    Версия справочника хранится в кэше default: после изменения
+    любой процесс сбрасывает версию, остальные перечитывают
+    таблицу при следующем обращении. Между процессами это
+    работает только с общим кэшем (файловым или memcached);
+    с LocMemCache изменения видит лишь свой процесс,
+    об этом предупреждает проверка api.W001.
+    """
+    check_interval = 1
+
+    def __init__(self, model):
+        self.model = model
+        self.version_key = f'reference:{model._meta.label_lower}:version'
+        self._lock = threading.Lock()
+        self._state = None
+        self._checked = 0
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, uuid4().hex, None)
+            version = cache.get(self.version_key)
+        return version
+
+    def invalidate(self):
+        cache.set(self.version_key, uuid4().hex, None)
+        self._state = None
+
+    def _current(self):
+        state = self._state
+        now = time.monotonic()
+        if state is not None and now - self._checked < self.check_interval:
+            return state
+        version = self.version()
+        if state is None or state['version'] != version:
+            with self._lock:
+                # Пока ждали блокировку, таблицу мог перечитать
+                # другой поток.
+                state = self._state
+                if state is None or state['version'] != version:
+                    objects = list(self.model.objects.using(
+                        DEFAULT_DB_ALIAS).order_by('pk'))
+                    state = {
+                        'version': version,
+                        'objects': objects,
+                        'by_pk': {obj.pk: obj for obj in objects},
+                        'content': {},
+                    }
+                    self._state = state
+        self._checked = now
+        return state
+
+    def all(self):
+        return self._current()['objects']
+
+    def get(self, pk):
+        obj = self._current()['by_pk'].get(pk)
+        if obj is None:
+            obj = self.model.objects.filter(pk=pk).first()
+            if obj is not None:
+                self._state = None
+        return obj
+
+    def content(self, serializer_class):
+        """Готовый JSON списка для сериализатора."""
+        state = self._current()
+        content = state['content'].get(serializer_class)
+        if content is None:
+            content = JSONRenderer().render(
+                serializer_class(state['objects'], many=True).data)
+            state['content'][serializer_class] = content
+        return content
+
+
+tags = ReferenceCache(Tag)
+ingredients = ReferenceCache(Ingredient)
+
+
+class Generations:
+    """
+    Счетчики поколений данных в общем кэше. Изменение данных
+    увеличивает счетчик, и все ответы, собранные по старому
+    поколению, перестают находиться по ключу.
+    Пропавший из кэша счетчик начинается заново от текущего
+    времени, поэтому старые ключи не повторяются.
+    """
+    prefix = 'generation:'
+
+    def get(self, names):
+        keys = [self.prefix + name for name in names]
+        values = cache.get_many(keys)
+        for key in keys:
+            if key not in values:
+                cache.add(key, time.time_ns(), None)
+                values[key] = cache.get(key)
+        return tuple(values[key] for key in keys)
+
+    def bump(self, *names):
+        for name in names:
+            try:
+                cache.incr(self.prefix + name)
+            except ValueError:
+                cache.add(self.prefix + name, time.time_ns(), None)
+
+    def renew(self, names):
+        """
+        Новое значение сразу для многих счетчиков одним обращением
+        к кэшу: например, для всех, у кого рецепт в корзине.
+        """
+        value = time.time_ns()
+        cache.set_many({self.prefix + name: value for name in names}, None)
+
+
+class ResponseCache:
+    """Готовые ответы API по адресу, формату и поколениям данных."""
+    prefix = 'response:'
+
+    def key(self, request, generations):
+        query = sorted(
+            (name, value)
+            for name in request.query_params
+            for value in request.query_params.getlist(name)
+        )
+        raw = json.dumps([
+            request.get_host(), request.path, query,
+            request.accepted_renderer.format, generations,
+        ])
+        return self.prefix + md5(raw.encode()).hexdigest()
+
+    def get(self, key):
+        return cache.get(key)
+
+    def set(self, key, response):
+        cache.set(key, {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'etag': response.get('ETag'),
+            'last_modified': response.get('Last-Modified'),
+        }, settings.RESPONSE_CACHE_TIMEOUT)
+
+
+class RecipeRepresentations:
+    """
+    Общее для всех пользователей представление рецепта.
+    Ключ меняется вместе с updated_at рецепта, версиями справочников
+    и поколением пользователей, поэтому старые записи не сбрасываются,
+    а просто перестают читаться.
+    """
+    prefix = 'recipe:'
+
+    def get_many(self, recipes, request, render):
+        """
+        Представления рецептов по порядку; недостающие строит
+        render(список рецептов) -> {id: представление}.
+        Для удаленных рецептов возвращается None.
+        """
+        versions = (
+            request.get_host(), tags.version(), ingredients.version(),
+            *generations.get(('users',)),
+        )
+        keys = {
+            recipe.pk: self.prefix + md5(json.dumps([
+                recipe.pk, recipe.updated_at.isoformat(), versions
+            ]).encode()).hexdigest()
+            for recipe in recipes
+        }
+        found = cache.get_many(keys.values())
+        missing = [
+            recipe for recipe in recipes if keys[recipe.pk] not in found]
+        metrics.recipe_cache.inc(len(recipes) - len(missing), result='hit')
+        if missing:
+            metrics.recipe_cache.inc(len(missing), result='miss')
+            with replicas.primary():
+                rendered = render(missing)
+            cache.set_many({
+                keys[pk]: data for pk, data in rendered.items()})
+            found.update(
+                (keys[pk], data) for pk, data in rendered.items())
+        return [found.get(keys[recipe.pk]) for recipe in recipes]
+
+
+class UserFlags:
+    """
+    Идентификаторы рецептов в избранном и списке покупок
+    и авторов из подписок пользователя.
+    """
+    prefix = 'user-flags:'
+
+    def generation(self, user_id):
+        return f'{self.prefix}{user_id}'
+
+    def get(self, user):
+        generation, = generations.get((self.generation(user.pk),))
+        key = f'{self.prefix}{user.pk}:{generation}'
+        flags = cache.get(key)
+        if flags is None:
+            with replicas.primary():
+                flags = {
+                    'favorites': set(Favorite.objects.filter(
+                        user=user).values_list('recipe', flat=True)),
+                    'carts': set(ShopingCart.objects.filter(
+                        user=user).values_list('recipe', flat=True)),
+                    'follows': set(Follow.objects.filter(
+                        user=user).values_list('following', flat=True)),
+                }
+            cache.set(key, flags)
+        return flags
+
+    def invalidate(self, user_id):
+        generations.bump(self.generation(user_id))
+
+
+class TokenCache:
+    """
+    Пользователи по ключу токена в памяти процесса: LRU на
+    TOKEN_CACHE_SIZE записей, запись живет TOKEN_CACHE_TTL секунд.
+    С TOKEN_CACHE_SHARED промах проверяется еще и в общем кэше.
+    Удаленный токен (выход через djoser) отмечается в общем
+    кэше на TOKEN_CACHE_TTL секунд, и каждый процесс вычеркивает
+    только его. Изменение пользователя увеличивает поколение
+    'tokens': процесс, где это случилось, сразу очищает свои
+    записи, остальные - при проверке поколения раз
+    в check_interval секунд. Хеш пароля не кэшируется.
+    """
+    prefix = 'token:'
+    revoked_prefix = 'token-revoked:'
+    check_interval = 1
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generation = None
+        self._checked = 0
+        self.fields = [
+            field.attname for field in User._meta.concrete_fields
+            if field.attname != 'password'
+        ]
+
+    def generation(self):
+        now = time.monotonic()
+        if (self._generation is None
+                or now - self._checked >= self.check_interval):
+            generation, = generations.get(('tokens',))
+            if generation != self._generation:
+                with self._lock:
+                    self._entries.clear()
+                self._generation = generation
+            self._checked = now
+        return self._generation
+
+    def get(self, key, load):
+        """
+        Пользователь по ключу токена; при промахе его читает
+        load(key), ошибки load не кэшируются.
+        """
+        generation = self.generation()
+        digest = sha256(key.encode()).hexdigest()
+        revoked_key = f'{self.revoked_prefix}{digest}'
+        shared_key = f'{self.prefix}{generation}:{digest}'
+        shared = getattr(settings, 'TOKEN_CACHE_SHARED', False)
+        found = cache.get_many(
+            [revoked_key, shared_key] if shared else [revoked_key])
+        now = time.monotonic()
+        if revoked_key in found:
+            with self._lock:
+                self._entries.pop(key, None)
+            metrics.token_cache.inc(result='revoked')
+            return load(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                metrics.token_cache.inc(result='hit')
+                return self._user(entry[0])
+        values = found.get(shared_key)
+        if values is not None:
+            metrics.token_cache.inc(result='shared_hit')
+        else:
+            metrics.token_cache.inc(result='miss')
+            user = load(key)
+            values = tuple(getattr(user, name) for name in self.fields)
+            if shared:
+                cache.set(shared_key, values, self.ttl)
+        with self._lock:
+            self._entries[key] = (values, now + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return self._user(values)
+
+    def revoke(self, key):
+        """
+        Вычеркивает удаленный токен: в этом процессе сразу,
+        в остальных - по отметке, которая живет не меньше их
+        записей.
+        """
+        cache.set(
+            f'{self.revoked_prefix}{sha256(key.encode()).hexdigest()}',
+            True, self.ttl)
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate(self):
+        generations.bump('tokens')
+        with self._lock:
+            self._entries.clear()
+        self._generation = None
+
+    @property
+    def size(self):
+        return getattr(settings, 'TOKEN_CACHE_SIZE', 10000)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'TOKEN_CACHE_TTL', 60)
+
+    def _user(self, values):
+        return User.from_db(DEFAULT_DB_ALIAS, self.fields, values)
+
+
+generations = Generations()
+responses = ResponseCache()
+recipes = RecipeRepresentations()
+user_flags = UserFlags()
+tokens = TokenCache()
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Версии справочников, поколения данных и токены сбрасываются
+    через кэш default: в кэше одного процесса остальные процессы
+    не увидят изменений.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in LOCAL_CACHES:
+        return []
+    return [Warning(
+        'Кэш default не общий для процессов: справочники и ответы '
+        'других процессов не сбрасываются при изменении данных.',
+        hint='Укажите общий CACHE_BACKEND (файловый или memcached) '
+             'или запускайте один процесс.',
+        id='api.W001',
+    )]
@@ -0,0 +1,103 @@
+import json
+import re
+
+from django.core.cache import cache as shared_cache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from . import benchmark
+
+# В планах SQLite не видно условий отбора, поэтому там ожидаемы
+# полные чтения для агрегатов списка, сортировки по rowid и
+# поиска по LIKE без триграммного индекса.
+SQLITE_FULL_READS = {
+    ('ingredients-list', 'recipes_ingredient'),
+    ('ingredients-search', 'recipes_ingredient'),
+    ('recipes-list', 'recipes_recipe'),
+    ('recipes-list-tags', 'recipes_recipe'),
+    ('users-list', 'users_user'),
+}
+ALIAS = re.compile(r'"(\w+)"\s+(?:AS\s+)?"?([A-Z]\d+)"?\b')
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?$')
+
+
+def table_sizes():
+    """Число строк в каждой таблице проекта."""
+    sizes = {}
+    with connection.cursor() as cursor:
+        for table in connection.introspection.table_names(cursor):
+            cursor.execute(
+                f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+            sizes[table] = cursor.fetchone()[0]
+    return sizes
+
+
+def sequential_scans(sql):
+    """
+    Таблицы, которые план запроса читает целиком: в PostgreSQL
+    последовательное чтение с условием отбора, в SQLite
+    любое чтение без индекса.
+    В PostgreSQL план строится с enable_seqscan = off: на малых
+    таблицах полное чтение может быть дешевле, а здесь важно,
+    есть ли для условия подходящий индекс.
+    """
+    aliases = {alias: table for table, alias in ALIAS.findall(sql)}
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            tables = set(_pg_seq_scans(plan[0]['Plan']))
+        else:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            tables = set()
+            for row in cursor.fetchall():
+                match = SQLITE_SCAN.match(row[-1])
+                if match:
+                    tables.add(match.group(2) or match.group(1))
+    return {aliases.get(table, table) for table in tables}
+
+
+def _pg_seq_scans(node):
+    if node['Node Type'] == 'Seq Scan' and 'Filter' in node:
+        yield node['Relation Name']
+    for child in node.get('Plans', ()):
+        yield from _pg_seq_scans(child)
+
+
+def audit(min_rows, page_size=benchmark.PAGE_SIZES[-1]):
+    """
+    Выполняет каждый эндпоинт с пустым кэшем, строит план
+    для всех его SELECT и возвращает полные чтения таблиц,
+    в которых не меньше min_rows строк.
+    """
+    sizes = table_sizes()
+    expected = (
+        SQLITE_FULL_READS if connection.vendor == 'sqlite' else set())
+    anonymous, client, urls = benchmark.prepare()
+    findings = []
+    checked = 0
+    for name, method, url, auth, paginated in urls:
+        url = url.format(limit=page_size)
+        shared_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client if auth else anonymous, method)(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        for query in queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            checked += 1
+            for table in sorted(sequential_scans(sql)):
+                if (sizes.get(table, 0) < min_rows
+                        or (name, table) in expected):
+                    continue
+                findings.append({
+                    'endpoint': name, 'method': method.upper(),
+                    'url': url, 'table': table, 'rows': sizes[table],
+                    'sql': sql,
+                })
+    return checked, findings
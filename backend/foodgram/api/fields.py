@@ -0,0 +1,187 @@
+import binascii
+import re
+import uuid
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.fields import SkipField
+
+IMAGE_SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'png',
+    b'\xff\xd8\xff': 'jpeg',
+    b'GIF87a': 'gif',
+    b'GIF89a': 'gif',
+}
+DECODE_CHUNK_SIZE = 64 * 1024
+NOT_BASE64 = re.compile(r'[^A-Za-z0-9+/=]')
+
+
+def _base64_chunks(payload):
+    """
+    Декодирует base64 частями. Символы вне алфавита (переводы
+    строк, пробелы) отбрасываются, как в base64.b64decode,
+    до деления на группы по 4 символа, а неполная группа
+    переносится в следующую часть.
+    """
+    pending = ''
+    for start in range(0, len(payload), DECODE_CHUNK_SIZE):
+        pending += NOT_BASE64.sub(
+            '', payload[start:start + DECODE_CHUNK_SIZE])
+        aligned = len(pending) // 4 * 4
+        if aligned:
+            yield binascii.a2b_base64(pending[:aligned])
+            pending = pending[aligned:]
+    if pending:
+        yield binascii.a2b_base64(pending)
+
+
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Поле связи, которое ищет объекты в кэше справочника."""
+
+    def __init__(self, reference, **kwargs):
+        self.reference = reference
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        obj = self.reference.get(pk)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+
+class ImageVariantsField(serializers.Field):
+    """Ссылки на уменьшенные варианты картинки рецепта."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        urls = {}
+        for name, path in value.items():
+            url = default_storage.url(path)
+            urls[name] = (
+                request.build_absolute_uri(url) if request is not None
+                else url
+            )
+        return urls
+
+
+class LimitedBase64ImageField(serializers.ImageField):
+    """
+    Картинка в base64 с проверками до полного декодирования:
+    размер строки, сигнатура формата и размеры по заголовку.
+    Декодируется частями во временный файл.
+    """
+    default_error_messages = {
+        'max_size': 'Картинка больше {max_size} байт.',
+        'max_dimension': (
+            'Картинка больше {max_dimension} пикселей по стороне.'),
+        'invalid_image': (
+            'Загрузите корректную картинку в формате PNG, JPEG, GIF '
+            'или WebP.'),
+    }
+
+    def __init__(self, **kwargs):
+        self.max_size = kwargs.pop(
+            'max_size', settings.RECIPE_IMAGE_MAX_SIZE)
+        self.max_dimension = kwargs.pop(
+            'max_dimension', settings.RECIPE_IMAGE_MAX_DIMENSION)
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            if data.startswith('http'):
+                raise SkipField()
+            upload = self.decode(data)
+        else:
+            upload = serializers.FileField.to_internal_value(self, data)
+            if upload.size > self.max_size:
+                self.fail('max_size', max_size=self.max_size)
+        self.verify(upload)
+        return upload
+
+    def decode(self, data):
+        _, separator, payload = data.partition(';base64,')
+        if not separator:
+            payload = data
+        encoded = len(payload) - sum(map(payload.count, ' \t\r\n'))
+        if encoded // 4 * 3 > self.max_size:
+            self.fail('max_size', max_size=self.max_size)
+        file = SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        size = 0
+        extension = None
+        try:
+            for chunk in _base64_chunks(payload):
+                if extension is None:
+                    extension = self.check_header(chunk)
+                file.write(chunk)
+                size += len(chunk)
+                if size > self.max_size:
+                    self.fail('max_size', max_size=self.max_size)
+        except binascii.Error:
+            file.close()
+            self.fail('invalid_image')
+        except serializers.ValidationError:
+            file.close()
+            raise
+        if not size:
+            file.close()
+            self.fail('empty')
+        file.seek(0)
+        return UploadedFile(
+            file, name=f'{uuid.uuid4()}.{extension}',
+            content_type=f'image/{extension}', size=size)
+
+    def check_header(self, chunk):
+        """
+        Формат по сигнатуре и размеры по заголовку, если
+        они поместились в первую часть файла.
+        """
+        extension = next(
+            (extension for signature, extension in IMAGE_SIGNATURES.items()
+             if chunk.startswith(signature)),
+            'webp' if chunk[:4] == b'RIFF' and chunk[8:12] == b'WEBP'
+            else None
+        )
+        if extension is None:
+            self.fail('invalid_image')
+        try:
+            size = Image.open(BytesIO(chunk)).size
+        except Exception:
+            return extension
+        self.check_dimensions(size)
+        return extension
+
+    def check_dimensions(self, size):
+        if max(size) > self.max_dimension:
+            self.fail('max_dimension', max_dimension=self.max_dimension)
+
+    def verify(self, upload):
+        """Проверка всей картинки без копии файла в памяти."""
+        try:
+            upload.seek(0)
+            image = Image.open(upload)
+            self.check_dimensions(image.size)
+            if image.format not in ('PNG', 'JPEG', 'GIF', 'WEBP'):
+                self.fail('invalid_image')
+            image.verify()
+        except serializers.ValidationError:
+            raise
+        except Exception:
+            self.fail('invalid_image')
+        finally:
+            upload.seek(0)
@@ -1,10 +1,11 @@
-from django.db.models import IntegerField, Value
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filters
 from recipes.models import Ingredient, Recipe, Tag
 
 
 class IngredientSearchFilter(filters.FilterSet):
     name = filters.CharFilter(method='search_by_name')
+    search_limit = 50
 
     class Meta:
         model = Ingredient
@@ -13,19 +14,7 @@ class IngredientSearchFilter(filters.FilterSet):
     def search_by_name(self, queryset, name, value):
         if not value:
             return queryset
-        start_with_queryset = (
-            queryset.filter(name__istartswith=value).annotate(
-                order=Value(0, IntegerField())
-            )
-        )
-        contain_queryset = (
-            queryset.filter(name__icontains=value).exclude(
-                pk__in=(ingredient.pk for ingredient in start_with_queryset)
-            ).annotate(
-                order=Value(1, IntegerField())
-            )
-        )
-        return start_with_queryset.union(contain_queryset).order_by('order')
+        return queryset.search(value, limit=self.search_limit)
 
 
 class RecipeFilter(filters.FilterSet):
@@ -33,14 +22,32 @@ class RecipeFilter(filters.FilterSet):
         queryset=Tag.objects.all(),
         field_name='tags__slug',
         to_field_name='slug',
+        method='get_tags',
     )
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart')
     is_favorited = filters.BooleanFilter(method='get_is_favorited')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'Популярные'),),
+        method='get_ordering'
+    )
 
     class Meta:
         model = Recipe
-        fields = ['author', 'tags', 'is_in_shopping_cart', 'is_favorited']
+        fields = [
+            'author', 'tags', 'is_in_shopping_cart', 'is_favorited',
+            'ordering'
+        ]
+
+    def get_tags(self, queryset, name, value):
+        """
+        Рецепты хотя бы с одним из тегов: подзапрос EXISTS
+        вместо соединения, без дублей и DISTINCT.
+        """
+        if not value:
+            return queryset
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag__in=[tag.pk for tag in value])))
 
     def get_is_favorited(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
@@ -51,3 +58,8 @@ class RecipeFilter(filters.FilterSet):
         if self.request.user.is_authenticated and value:
             return queryset.filter(shopping_cart__user=self.request.user)
         return queryset.all()
+
+    def get_ordering(self, queryset, name, value):
+        if value == 'popular':
+            return queryset.popular()
+        return queryset
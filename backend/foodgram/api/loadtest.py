@@ -0,0 +1,274 @@
+import asyncio
+import io
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from django.core.asgi import get_asgi_application
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from foodgram.asgi import ThreadPerRequest
+
+from . import benchmark
+
+ENDPOINTS = (
+    'tags-list', 'ingredients-list', 'ingredients-search', 'recipes-list',
+    'recipes-detail', 'recipes-download-shopping-cart',
+)
+CONNECTION_ENDPOINTS = ('tags-list', 'users-me', 'recipes-detail')
+
+
+class Latency:
+    """
+    Задержка каждого запроса к БД для execute_wrapper и учет
+    того, сколько запросов ждут ответа одновременно.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(self.seconds)
+            return execute(sql, params, many, context)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+@contextmanager
+def simulated_latency(latency):
+    """
+    Подключает задержку ко всем соединениям, и к новым тоже.
+    Соединение открывается внутри запроса, когда execute_wrapper
+    из QueryStatsMiddleware уже добавлен и снимется через pop(),
+    поэтому задержка ставится в начало списка.
+    """
+    def install(sender, connection, **kwargs):
+        connection.execute_wrappers.insert(0, latency)
+
+    for wrapper in connections.all():
+        wrapper.execute_wrappers.insert(0, latency)
+    connection_created.connect(install)
+    try:
+        yield latency
+    finally:
+        connection_created.disconnect(install)
+        for wrapper in connections.all():
+            if latency in wrapper.execute_wrappers:
+                wrapper.execute_wrappers.remove(latency)
+
+
+async def asgi_get(application, url, token=None):
+    """GET через ASGI-приложение; возвращает статус и тело."""
+    path, _, query = url.partition('?')
+    headers = [(b'host', b'testserver')]
+    if token:
+        headers.append((b'authorization', f'Token {token}'.encode()))
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path,
+        'raw_path': path.encode(), 'root_path': '',
+        'query_string': quote(query, safe='=&').encode(),
+        'headers': headers, 'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    status = None
+    body = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif message['type'] == 'http.response.body':
+            body.append(message.get('body', b''))
+
+    await application(scope, receive, send)
+    return status, b''.join(body)
+
+
+def _result(timings, statuses, elapsed, latency):
+    return {
+        'requests': len(timings),
+        'errors': sum(status != 200 for status in statuses),
+        'rps': round(len(timings) / elapsed, 1),
+        'p50_ms': round(statistics.median(timings), 1),
+        'p95_ms': round(benchmark.percentile(timings, 0.95), 1),
+        'db_concurrency': latency.peak,
+    }
+
+
+def run_wsgi(client, url, requests, latency):
+    """Синхронный воркер: запросы обрабатываются по одному."""
+    latency.peak = 0
+    timings = []
+    statuses = []
+    start = time.perf_counter()
+    for _ in range(requests):
+        began = time.perf_counter()
+        response = client.get(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        timings.append((time.perf_counter() - began) * 1000)
+        statuses.append(response.status_code)
+    return _result(timings, statuses, time.perf_counter() - start, latency)
+
+
+def run_asgi(application, url, token, requests, concurrency, latency):
+    """Один ASGI-процесс, не больше concurrency запросов сразу."""
+    latency.peak = 0
+    timings = []
+    statuses = []
+
+    async def one(slots):
+        async with slots:
+            began = time.perf_counter()
+            try:
+                status, _ = await asgi_get(application, url, token)
+            except Exception:
+                status = None
+            timings.append((time.perf_counter() - began) * 1000)
+            statuses.append(status)
+
+    async def main():
+        slots = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(one(slots) for _ in range(requests)))
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    return _result(timings, statuses, time.perf_counter() - start, latency)
+
+
+def run(requests, concurrency_levels, latency_ms):
+    """
+    Для каждого эндпоинта чтения сравнивает синхронный
+    WSGI-воркер, ASGI-приложение Django по умолчанию и
+    foodgram.asgi с заданной задержкой каждого запроса к БД.
+    Кэш прогревается одним запросом перед замером.
+    """
+    anonymous, client, urls = benchmark.prepare()
+    token = client._credentials['HTTP_AUTHORIZATION'].split()[1]
+    applications = (
+        ('asgi-django', get_asgi_application),
+        ('asgi', lambda: ThreadPerRequest(
+            get_asgi_application(), max(concurrency_levels))),
+    )
+    results = []
+    with simulated_latency(Latency(latency_ms / 1000)) as latency:
+        for name, method, url, auth, paginated in urls:
+            if name not in ENDPOINTS or method != 'get':
+                continue
+            url = url.format(limit=benchmark.PAGE_SIZES[0])
+            sync_client = client if auth else anonymous
+            run_wsgi(sync_client, url, 1, latency)
+            row = {
+                'endpoint': name, 'authenticated': auth, 'url': url,
+                'wsgi': run_wsgi(sync_client, url, requests, latency),
+            }
+            for mode, application in applications:
+                row[mode] = {
+                    concurrency: run_asgi(
+                        application(), url, token if auth else None,
+                        requests, concurrency, latency)
+                    for concurrency in concurrency_levels
+                }
+            results.append(row)
+    return results
+
+
+def wsgi_get(handler, url, credentials):
+    """
+    GET через WSGIHandler, как под gunicorn: в отличие от
+    тестового клиента, в начале и в конце запроса Django
+    закрывает устаревшие соединения.
+    """
+    path, _, query = url.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+        'QUERY_STRING': quote(query, safe='=&'), 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO(),
+        **credentials,
+    }
+    statuses = []
+    response = handler(
+        environ, lambda status, headers: statuses.append(status))
+    try:
+        b''.join(response)
+    finally:
+        response.close()
+    return int(statuses[0].split()[0])
+
+
+def connection_overhead(requests, max_age):
+    """
+    Время ответа эндпоинтов с токеном и число новых соединений
+    с БД на запрос: без постоянных соединений, с CONN_MAX_AGE
+    без проверки и с проверкой перед повторным использованием.
+    """
+    anonymous, client, urls = benchmark.prepare()
+    handler = WSGIHandler()
+    settings_dict = connection.settings_dict
+    saved = (
+        settings_dict['CONN_MAX_AGE'],
+        settings_dict.get('CONN_HEALTH_CHECKS', False))
+    variants = (
+        ('CONN_MAX_AGE=0', 0, False),
+        (f'CONN_MAX_AGE={max_age}', max_age, False),
+        (f'CONN_MAX_AGE={max_age} + проверка', max_age, True),
+    )
+    opened = []
+
+    def count(sender, **kwargs):
+        opened.append(1)
+
+    results = []
+    connection_created.connect(count)
+    try:
+        for name, method, url, auth, paginated in urls:
+            if name not in CONNECTION_ENDPOINTS or method != 'get':
+                continue
+            for variant, age, checks in variants:
+                settings_dict['CONN_MAX_AGE'] = age
+                settings_dict['CONN_HEALTH_CHECKS'] = checks
+                connection.close()
+                wsgi_get(handler, url, client._credentials)
+                opened.clear()
+                timings = []
+                statuses = []
+                for _ in range(requests):
+                    began = time.perf_counter()
+                    statuses.append(
+                        wsgi_get(handler, url, client._credentials))
+                    timings.append((time.perf_counter() - began) * 1000)
+                results.append({
+                    'endpoint': name, 'variant': variant,
+                    'errors': sum(status != 200 for status in statuses),
+                    'connects_per_request': round(
+                        len(opened) / requests, 2),
+                    'p50_ms': round(statistics.median(timings), 2),
+                    'p95_ms': round(
+                        benchmark.percentile(timings, 0.95), 2),
+                })
+    finally:
+        connection_created.disconnect(count)
+        (settings_dict['CONN_MAX_AGE'],
+         settings_dict['CONN_HEALTH_CHECKS']) = saved
+        connection.close()
+    return results
@@ -0,0 +1,106 @@
+import json
+import time
+
+import django
+from api import benchmark
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+
+# Реплики не участвуют: тестовая база создается только основная.
+BENCHMARK_SETTINGS = {
+    'CACHES': {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'benchmark',
+        }
+    },
+    'REPLICA_DATABASES': [],
+}
+
+
+class Command(BaseCommand):
+    """
+    Команда 'benchmark_api' создает тестовую базу, заполняет ее
+    данными и для каждого эндпоинта API замеряет число запросов
+    к БД с пустым и заполненным кэшем, p50/p95 времени ответа
+    и пиковую память на нескольких размерах страницы.
+    Завершается с ошибкой, если число запросов растет
+    с размером страницы.
+    Работает с базой из настроек: SQLite или PostgreSQL.
+    """
+    help = 'Замер запросов и времени ответа эндпоинтов API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale',
+            type=float,
+            default=1,
+            help='Масштаб набора данных (1 = 2000 пользователей, '
+                 '5000 рецептов).'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Повторов каждого GET-запроса для перцентилей.'
+        )
+        parser.add_argument(
+            '--output',
+            help='Файл для отчета в json.'
+        )
+        parser.add_argument(
+            '--keepdb',
+            action='store_true',
+            help='Не удалять тестовую базу после прогона.'
+        )
+
+    def handle(self, *args, **options):
+        sizes = benchmark.scaled(options['scale'])
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            with override_settings(**BENCHMARK_SETTINGS):
+                start = time.monotonic()
+                benchmark.seed(sizes)
+                self.stdout.write(
+                    f'Данные созданы за {time.monotonic() - start:.1f} с.')
+                results, failures = benchmark.run(options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+        for result in results:
+            self.stdout.write(
+                '{method:6} {endpoint:32} {page:>5} {status} '
+                'запросов: {queries:3}/{warm:<3} p50: {p50} p95: {p95} '
+                'память: {memory} КБ'.format(
+                    method=result['method'],
+                    endpoint=result['endpoint']
+                    + (' (auth)' if result['authenticated'] else ''),
+                    page=result['page_size'] or '-',
+                    status=result['status'],
+                    queries=result['queries'],
+                    warm=(
+                        '-' if result['queries_warm'] is None
+                        else result['queries_warm']),
+                    p50=result['p50_ms'],
+                    p95=result['p95_ms'],
+                    memory=result['peak_memory_kb'],
+                )
+            )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump({
+                    'database': connection.vendor,
+                    'django': django.get_version(),
+                    'dataset': sizes,
+                    'repeat': options['repeat'],
+                    'results': results,
+                    'failures': failures,
+                }, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Отчет сохранен в {options["output"]}.')
+        if failures:
+            raise CommandError('\n'.join(failures))
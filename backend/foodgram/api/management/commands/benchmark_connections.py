@@ -0,0 +1,64 @@
+from api import benchmark, loadtest
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+
+from .benchmark_api import BENCHMARK_SETTINGS
+
+
+class Command(BaseCommand):
+    """
+    Команда 'benchmark_connections' создает тестовую базу с набором
+    данных из benchmark_api и сравнивает время ответа дешевых
+    эндпоинтов с токеном без постоянных соединений с БД и с ними.
+    Запросы идут через WSGIHandler, как под gunicorn.
+    Разница заметна на PostgreSQL: в SQLite тестовая база
+    в памяти и соединение не закрывается.
+    """
+    help = 'Затраты на соединение с БД в каждом запросе.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale',
+            type=float,
+            default=0.05,
+            help='Масштаб набора данных (1 = 2000 пользователей, '
+                 '5000 рецептов).'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Запросов к каждому эндпоинту в одном прогоне.'
+        )
+        parser.add_argument(
+            '--max-age',
+            type=int,
+            default=60,
+            help='CONN_MAX_AGE для сравнения, секунд.'
+        )
+        parser.add_argument(
+            '--keepdb',
+            action='store_true',
+            help='Не удалять тестовую базу после прогона.'
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            with override_settings(**BENCHMARK_SETTINGS):
+                benchmark.seed(benchmark.scaled(options['scale']))
+                results = loadtest.connection_overhead(
+                    options['requests'], options['max_age'])
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+        for result in results:
+            self.stdout.write(
+                '{endpoint:16} {variant:32} соединений на запрос: '
+                '{connects_per_request:<5} p50: {p50_ms} p95: {p95_ms} '
+                'ошибок: {errors}'.format(**result))
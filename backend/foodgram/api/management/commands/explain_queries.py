@@ -0,0 +1,61 @@
+from api import benchmark, explain
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+
+from .benchmark_api import BENCHMARK_SETTINGS
+
+
+class Command(BaseCommand):
+    """
+    Команда 'explain_queries' создает тестовую базу с набором
+    данных из benchmark_api, выполняет эндпоинты API и строит
+    план для каждого их SELECT. Завершается с ошибкой, если
+    какой-то запрос читает большую таблицу целиком.
+    """
+    help = 'Поиск полных чтений таблиц в запросах эндпоинтов API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale',
+            type=float,
+            default=1,
+            help='Масштаб набора данных (1 = 2000 пользователей, '
+                 '5000 рецептов).'
+        )
+        parser.add_argument(
+            '--min-rows',
+            type=int,
+            default=1000,
+            help='Не учитывать таблицы меньше этого числа строк.'
+        )
+        parser.add_argument(
+            '--keepdb',
+            action='store_true',
+            help='Не удалять тестовую базу после прогона.'
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            with override_settings(**BENCHMARK_SETTINGS):
+                benchmark.seed(benchmark.scaled(options['scale']))
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+                checked, findings = explain.audit(options['min_rows'])
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+        self.stdout.write(f'Проверено запросов: {checked}.')
+        for finding in findings:
+            self.stdout.write(
+                '{method:6} {endpoint}: полное чтение {table} '
+                '({rows} строк)\n    {sql}'.format(**finding))
+        if findings:
+            raise CommandError(
+                f'Полных чтений больших таблиц: {len(findings)}.')
+        self.stdout.write('Полных чтений больших таблиц нет.')
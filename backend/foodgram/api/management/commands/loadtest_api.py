@@ -0,0 +1,96 @@
+import json
+
+from api import benchmark, loadtest
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+
+from .benchmark_api import BENCHMARK_SETTINGS
+
+MODES = ('asgi-django', 'asgi')
+
+
+class Command(BaseCommand):
+    """
+    Команда 'loadtest_api' создает тестовую базу с набором данных
+    из benchmark_api и для эндпоинтов чтения сравнивает, сколько
+    запросов в секунду обрабатывает один процесс: синхронный
+    WSGI-воркер, ASGI-приложение Django по умолчанию и
+    foodgram.asgi при нескольких уровнях параллельности.
+    Каждый запрос к БД задерживается на --latency мс.
+    """
+    help = 'Нагрузочное сравнение WSGI и ASGI на один процесс.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale',
+            type=float,
+            default=0.1,
+            help='Масштаб набора данных (1 = 2000 пользователей, '
+                 '5000 рецептов).'
+        )
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=5,
+            help='Задержка каждого запроса к БД, мс.'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=100,
+            help='Запросов к каждому эндпоинту в одном прогоне.'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            nargs='+',
+            default=[1, 8, 32],
+            help='Уровни параллельности для ASGI.'
+        )
+        parser.add_argument(
+            '--output',
+            help='Файл для отчета в json.'
+        )
+        parser.add_argument(
+            '--keepdb',
+            action='store_true',
+            help='Не удалять тестовую базу после прогона.'
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            with override_settings(**BENCHMARK_SETTINGS):
+                benchmark.seed(benchmark.scaled(options['scale']))
+                results = loadtest.run(
+                    options['requests'], options['concurrency'],
+                    options['latency'])
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+        line = ('  {mode:11} {concurrency:>4} {rps:>8} req/s '
+                'p50: {p50_ms} p95: {p95_ms} '
+                'БД одновременно: {db_concurrency} ошибок: {errors}')
+        for result in results:
+            self.stdout.write(
+                result['endpoint']
+                + (' (auth)' if result['authenticated'] else ''))
+            self.stdout.write(line.format(
+                mode='wsgi', concurrency=1, **result['wsgi']))
+            for mode in MODES:
+                for concurrency, row in result[mode].items():
+                    self.stdout.write(line.format(
+                        mode=mode, concurrency=concurrency, **row))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump({
+                    'database': connection.vendor,
+                    'latency_ms': options['latency'],
+                    'results': results,
+                }, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Отчет сохранен в {options["output"]}.')
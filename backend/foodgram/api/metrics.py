@@ -0,0 +1,146 @@
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.http import HttpResponse
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _labels(labels):
+    return ','.join(
+        '{}="{}"'.format(
+            name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in sorted(labels.items())
+    )
+
+
+class Counter:
+    """Счетчик с метками."""
+    kind = 'counter'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+        self._values = defaultdict(float)
+
+    def inc(self, value=1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] += value
+
+    def value(self, **labels):
+        return self._values.get(_labels(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, key, value
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и метками."""
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = _labels(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {
+                key: (list(counts), total)
+                for key, (counts, total) in self._values.items()
+            }
+        for key, (counts, total) in sorted(values.items()):
+            prefix = f'{key},' if key else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', f'{prefix}le="{bound}"', (
+                    cumulative)
+            yield f'{self.name}_sum', key, total
+            yield f'{self.name}_count', key, cumulative
+
+
+class Registry:
+    """Метрики процесса в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, description):
+        return self._register(Counter(name, description))
+
+    def histogram(self, name, description, buckets=DURATION_BUCKETS):
+        return self._register(Histogram(name, description, buckets))
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                labels = f'{{{labels}}}' if labels else ''
+                lines.append(f'{name}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    'foodgram_request_duration_seconds', 'Время обработки запроса.')
+request_queries = registry.histogram(
+    'foodgram_request_queries', 'SQL-запросов на запрос.', QUERY_BUCKETS)
+request_sql_duration = registry.histogram(
+    'foodgram_request_sql_duration_seconds', 'Время SQL на запрос.')
+request_duplicate_queries = registry.counter(
+    'foodgram_request_duplicate_queries_total',
+    'Повторные SQL-запросы с тем же текстом.')
+response_size = registry.histogram(
+    'foodgram_response_size_bytes', 'Размер ответа.', SIZE_BUCKETS)
+response_cache = registry.counter(
+    'foodgram_response_cache_total',
+    'Обращения к кэшу ответов анонимным пользователям.')
+recipe_cache = registry.counter(
+    'foodgram_recipe_cache_total',
+    'Обращения к кэшу представлений рецептов.')
+token_cache = registry.counter(
+    'foodgram_token_cache_total',
+    'Обращения к кэшу токенов: в памяти, в общем кэше, промахи, '
+    'отозванные.')
+db_connections = registry.counter(
+    'foodgram_db_connections_total',
+    'Соединения с БД: открыто, переиспользовано, закрыто, '
+    'не прошло проверку.')
+db_connect_duration = registry.histogram(
+    'foodgram_db_connect_duration_seconds',
+    'Время установки соединения с БД.')
+
+
+def metrics(request):
+    """Метрики процесса для Prometheus."""
+    return HttpResponse(
+        registry.render(), content_type='text/plain; version=0.0.4')
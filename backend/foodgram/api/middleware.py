@@ -0,0 +1,123 @@
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+from . import metrics, replicas
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """Счетчик SQL-запросов для execute_wrapper."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        return sum(
+            count - 1 for count in self.statements.values() if count > 1)
+
+
+class QueryStatsMiddleware:
+    """
+    Время ответа, число и время SQL-запросов, повторы и размер ответа
+    по каждому эндпоинту: в заголовке Server-Timing и в метриках.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.threshold = getattr(
+            settings, 'QUERY_STATS_N_PLUS_ONE_THRESHOLD', 10)
+
+    def __call__(self, request):
+        stats = QueryStats()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+        endpoint = (
+            request.resolver_match.view_name
+            if request.resolver_match else 'unresolved'
+        )
+        labels = {'endpoint': endpoint, 'method': request.method}
+        metrics.request_duration.observe(duration, **labels)
+        metrics.request_queries.observe(stats.count, **labels)
+        metrics.request_sql_duration.observe(stats.duration, **labels)
+        if stats.duplicates:
+            metrics.request_duplicate_queries.inc(stats.duplicates, **labels)
+        if not response.streaming:
+            metrics.response_size.observe(len(response.content), **labels)
+        response['Server-Timing'] = (
+            f'db;dur={stats.duration * 1000:.1f};'
+            f'desc="{stats.count} queries", '
+            f'app;dur={duration * 1000:.1f}'
+        )
+        if self.threshold and stats.duplicates >= self.threshold:
+            sql, count = stats.statements.most_common(1)[0]
+            logger.warning(
+                'N+1 в %s %s: %s повторных запросов, %s раз: %s',
+                request.method, endpoint, stats.duplicates, count, sql[:300]
+            )
+        return response
+
+
+class ReplicaMiddleware:
+    """
+    Безопасные запросы читают со случайной реплики из
+    REPLICA_DATABASES. После запроса на изменение клиент
+    REPLICA_STICKY_SECONDS секунд читает с основной базы, пока
+    реплики догоняют ее. Клиент определяется по токену или cookie
+    сессии, отметка хранится в общем кэше. Без реплик отключена.
+    """
+
+    def __init__(self, get_response):
+        self.replicas = list(getattr(settings, 'REPLICA_DATABASES', ()))
+        if not self.replicas:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+
+    def sticky_key(self, request):
+        credential = (
+            request.META.get('HTTP_AUTHORIZATION')
+            or request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+        if not credential:
+            return None
+        return f'replica:sticky:{md5(credential.encode()).hexdigest()}'
+
+    def __call__(self, request):
+        key = self.sticky_key(request)
+        if request.method not in SAFE_METHODS or (key and cache.get(key)):
+            token = replicas.read_from(DEFAULT_DB_ALIAS)
+        else:
+            token = replicas.read_from(random.choice(self.replicas))
+        try:
+            response = self.get_response(request)
+        finally:
+            replicas.reset(token)
+        if request.method not in SAFE_METHODS and key:
+            cache.set(key, True, self.sticky_seconds)
+        return response
@@ -1,7 +1,249 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from recipes.models import Recipe
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class CustomPagination(PageNumberPagination):
+    """
+    Постраничный вывод по page/limit.
+    С параметром cursor включается курсорный режим: страница
+    выбирается по значениям полей сортировки последней записи
+    без OFFSET. Общее количество в этом режиме по умолчанию не
+    считается, count=estimate дает оценку, count=exact - точное.
+    """
     page_query_param = 'page'
     page_size_query_param = 'limit'
     page_size = 6
+    cursor_query_param = 'cursor'
+    cursor_only = False
+    count_query_param = 'count'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = (
+            self.cursor_only
+            or self.cursor_query_param in request.query_params)
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        values, self.reverse = self.decode_cursor(request)
+        self.count = self.get_count(queryset, request)
+
+        results = self.fetch(queryset, values)
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+            self.has_next = values is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = values is not None
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.cursor_mode:
+            return super().get_previous_link()
+        if not self.has_previous or not self.page:
+            return None
+        return self._link(self.page[0], reverse=True)
+
+    def get_ordering(self, queryset):
+        """Сортировка запроса с id в конце для однозначности."""
+        ordering = list(
+            queryset.query.order_by or queryset.model._meta.ordering)
+        names = {field.lstrip('-') for field in ordering}
+        if not names & {'id', 'pk'}:
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append('-id' if descending else 'id')
+        return tuple(ordering)
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'exact':
+            return queryset.count()
+        if mode == 'estimate':
+            return estimate_count(queryset)
+        return None
+
+    def fetch(self, queryset, values):
+        """Страница и еще одна запись, чтобы знать, есть ли дальше."""
+        return list(self._keyset(queryset, self.ordering, values)[
+            :self.page_size + 1])
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            position = json.loads(urlsafe_b64decode(cursor.encode()).decode())
+            values, reverse = position['v'], bool(position['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(
+                self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def _link(self, obj, reverse):
+        values = [
+            getattr(obj, field.lstrip('-')) for field in self.ordering]
+        cursor = urlsafe_b64encode(json.dumps(
+            {'v': values, 'r': int(reverse)}, default=_encode
+        ).encode()).decode()
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def _keyset(self, queryset, ordering, values):
+        """Запрос в порядке курсора, начиная после него."""
+        if self.reverse:
+            queryset = queryset.order_by(
+                *(self._invert(field) for field in ordering))
+        else:
+            queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self._after(
+                self._clean(queryset, values, ordering), ordering))
+        return queryset
+
+    def _clean(self, queryset, values, ordering):
+        """
+        Значения курсора в типах полей сортировки; подделанный
+        курсор дает 404, как в CursorPagination.
+        """
+        cleaned = []
+        for field, value in zip(ordering, values):
+            try:
+                value = _ordering_field(
+                    queryset, field.lstrip('-')).to_python(value)
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            cleaned.append(value)
+        return cleaned
+
+    def _after(self, values, ordering):
+        """
+        Условие "после курсора" для составного ключа:
+        (a > x) or (a = x and b > y) or ...
+        Дополнительное a >= x задает начало диапазона по индексу.
+        """
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != self.reverse
+            lookup = f'{name}__{"lt" if descending else "gt"}'
+            condition |= Q(**equal, **{lookup: value})
+            if not equal:
+                bound = Q(**{f'{lookup}e': value})
+            equal[name] = value
+        if len(equal) > 1:
+            condition &= bound
+        return condition
+
+    @staticmethod
+    def _invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+
+class FeedPagination(CustomPagination):
+    """
+    Лента подписок: всегда по курсору и без общего количества.
+    Страница собирается из ленты пользователя и рецептов,
+    которые не рассылались по лентам.
+    """
+    cursor_only = True
+    timeline_ordering = ('-created', '-recipe_id')
+    recipe_fields = ('id', 'author', 'created', 'updated_at')
+
+    def get_ordering(self, queryset):
+        return ('-created', '-id')
+
+    def get_count(self, queryset, request):
+        return None
+
+    def fetch(self, queryset, values):
+        limit = self.page_size + 1
+        entries = queryset.select_related('recipe').only(
+            'created', 'recipe',
+            *(f'recipe__{field}' for field in self.recipe_fields))
+        recipes = [
+            entry.recipe for entry in self._keyset(
+                entries, self.timeline_ordering, values)[:limit]
+        ]
+        recipes += self._keyset(
+            Recipe.objects.not_in_timelines(self.request.user).only(
+                *self.recipe_fields),
+            self.ordering, values)[:limit]
+        unique = {recipe.pk: recipe for recipe in recipes}
+        return sorted(
+            unique.values(), key=lambda recipe: (recipe.created, recipe.pk),
+            reverse=not self.reverse)[:limit]
+
+
+def _ordering_field(queryset, name):
+    """Поле модели или аннотации, по которому идет сортировка."""
+    annotation = queryset.query.annotations.get(name)
+    if annotation is not None:
+        return annotation.output_field
+    model = queryset.model
+    *path, name = name.split('__')
+    for part in path:
+        model = model._meta.get_field(part).related_model
+    return model._meta.get_field(name)
+
+
+def _encode(value):
+    """Даты в курсоре сохраняются без потери микросекунд."""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def estimate_count(queryset):
+    """
+    Оценка количества строк по плану запроса в PostgreSQL.
+    В остальных базах - точный COUNT.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
@@ -0,0 +1,78 @@
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """
+    Базовый формат списка покупок.
+    Строки списка отдаются по одной, документ целиком
+    в памяти не собирается.
+    """
+    charset = 'utf-8'
+
+    def stream(self, ingredients):
+        raise NotImplementedError
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            return '\n'.join(str(value) for value in data.values()).encode(
+                self.charset)
+        return b''.join(self.stream(data))
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок текстом."""
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        yield 'Список покупок:\n\n'.encode(self.charset)
+        for ingredient in ingredients:
+            yield (
+                f'{ingredient["name"]}: '
+                f'{ingredient["total"]} '
+                f'{ingredient["measurement_unit"]}\n'
+            ).encode(self.charset)
+
+
+class CsvShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в csv."""
+    media_type = 'text/csv'
+    format = 'csv'
+    fields = ('name', 'total', 'measurement_unit')
+
+    class _Line:
+        def write(self, value):
+            return value
+
+    def stream(self, ingredients):
+        writer = csv.writer(self._Line())
+        yield writer.writerow(self.fields).encode(self.charset)
+        for ingredient in ingredients:
+            yield writer.writerow(
+                [ingredient[field] for field in self.fields]
+            ).encode(self.charset)
+
+
+class JsonShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в json."""
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, ingredients):
+        separator = '['
+        for ingredient in ingredients:
+            yield (
+                separator + json.dumps(ingredient, ensure_ascii=False)
+            ).encode(self.charset)
+            separator = ','
+        yield ('[]' if separator == '[' else ']').encode(self.charset)
+
+
+SHOPPING_LIST_RENDERERS = (
+    TextShoppingListRenderer,
+    CsvShoppingListRenderer,
+    JsonShoppingListRenderer,
+)
@@ -0,0 +1,59 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Токены и сессии читаются только с основной базы: новый токен
+# или ключ сессии нужен в следующем же запросе, а по нему еще
+# нельзя понять, что клиент только что писал.
+PRIMARY_MODELS = {'authtoken.token', 'sessions.session'}
+
+_read_database = ContextVar('read_database', default=None)
+
+
+def read_from(alias):
+    """База для чтения до reset(token) в текущем контексте."""
+    return _read_database.set(alias)
+
+
+def reset(token):
+    _read_database.reset(token)
+
+
+@contextmanager
+def primary():
+    """
+    Чтение с основной базы внутри блока. Так заполняются общие
+    кэши: отстающая реплика иначе положит старые строки под новую
+    версию, и они будут отдаваться все время жизни записи.
+    """
+    token = read_from(DEFAULT_DB_ALIAS)
+    try:
+        yield
+    finally:
+        reset(token)
+
+
+class ReplicaRouter:
+    """
+    Чтение идет на реплику, которую ReplicaMiddleware выбрала для
+    запроса, остальное - на основную базу: запись, чтение вне
+    запросов, внутри транзакций и моделей из PRIMARY_MODELS.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _read_database.get()
+        if (alias is None
+                or model._meta.label_lower in PRIMARY_MODELS
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -1,10 +1,18 @@
+from django.contrib.auth.models import AnonymousUser
+from django.db import models, transaction
 from djoser.serializers import UserCreateSerializer
-from drf_base64.fields import Base64ImageField
+from recipes import images
 from recipes.models import (Favorite, Ingredient, IngredientAmountRecipe,
-                            Recipe, ShopingCart, Tag)
+                            Recipe, ShopingCart, ShoppingCartTotal, Tag,
+                            TimelineEntry)
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
 from users.models import Follow, User
 
+from . import cache
+from .fields import (CachedPrimaryKeyRelatedField, ImageVariantsField,
+                     LimitedBase64ImageField)
+
 
 class TagSerializer(serializers.ModelSerializer):
     """Сериализатор тегов."""
@@ -22,9 +30,11 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 class RecipeSerializer(serializers.ModelSerializer):
     """Сериализатор рецепта базовый."""
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -43,10 +53,12 @@ class UserSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
-        return Follow.objects.filter(
-            user__username=user,
-            following__username=obj.username).exists()
+        if user.is_anonymous or user.pk == obj.pk:
+            return False
+        return obj.pk in cache.user_flags.get(user)['follows']
 
 
 class UserCustomCreateSerializer(UserCreateSerializer):
@@ -81,7 +93,8 @@ class IngredientAmountRecipeSerializer(serializers.ModelSerializer):
 class IngredientWriteSerializer(serializers.ModelSerializer):
     """Сериализатор ингредиентов для записи рецепта."""
     amount = serializers.IntegerField(write_only=True)
-    id = serializers.PrimaryKeyRelatedField(
+    id = CachedPrimaryKeyRelatedField(
+        reference=cache.ingredients,
         source='ingredient',
         queryset=Ingredient.objects.all()
     )
@@ -101,8 +114,18 @@ class IngredientWriteSerializer(serializers.ModelSerializer):
         return data
 
 
+class RecipeListSerializer(serializers.ListSerializer):
+    """Список рецептов: общие представления из кэша и флаги."""
+
+    def to_representation(self, data):
+        recipes = data.all() if isinstance(data, models.Manager) else data
+        return self.child.represent(list(recipes))
+
+
 class RecipeReadSerializer(serializers.ModelSerializer):
-    """Сериализатор рецепта на чтение."""
+    """Сериализатор рецепта на чтение.
+    Общее для всех представление берется из кэша,
+    флаги пользователя накладываются поверх."""
     author = UserSerializer()
     tags = TagSerializer(many=True)
     ingredients = IngredientAmountRecipeSerializer(
@@ -111,6 +134,7 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     )
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
@@ -123,20 +147,65 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_variants',
             'text',
             'cooking_time'
         )
+        list_serializer_class = RecipeListSerializer
+
+    def to_representation(self, instance):
+        represented = self.represent([instance])
+        if not represented:
+            # Рецепт удален, пока собирался ответ.
+            raise NotFound()
+        return represented[0]
+
+    def represent(self, recipes):
+        request = self.context.get('request')
+        public = cache.recipes.get_many(recipes, request, self.render)
+        flags = (
+            None if request.user.is_anonymous
+            else cache.user_flags.get(request.user)
+        )
+        result = []
+        for recipe, data in zip(recipes, public):
+            if data is None:
+                continue
+            if flags is None:
+                data['is_favorited'] = data['is_in_shopping_cart'] = None
+                data['author']['is_subscribed'] = False
+            else:
+                data['is_favorited'] = recipe.pk in flags['favorites']
+                data['is_in_shopping_cart'] = recipe.pk in flags['carts']
+                data['author']['is_subscribed'] = (
+                    recipe.author_id in flags['follows'])
+            result.append(data)
+        return result
+
+    def render(self, recipes):
+        """Представления рецептов без флагов пользователя."""
+        loaded = Recipe.objects.for_feed(AnonymousUser()).in_bulk(
+            [recipe.pk for recipe in recipes])
+        rendered = {}
+        for pk, recipe in loaded.items():
+            recipe.author.is_subscribed = recipe.author_is_subscribed
+            rendered[pk] = super().to_representation(recipe)
+        return rendered
 
     def get_is_favorited(self, obj):
         author = self.context.get('request').user
         if author.is_anonymous:
             return None
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return obj.favorites.filter(user=author, recipe=obj.pk).exists()
 
     def get_is_in_shopping_cart(self, obj):
         author = self.context.get('request').user
         if author.is_anonymous:
             return None
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return obj.shopping_cart.filter(user=author, recipe=obj.pk).exists()
 
 
@@ -144,10 +213,10 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
     """Создание рецепта."""
     author = serializers.HiddenField(default=serializers.CurrentUserDefault())
     ingredients = IngredientWriteSerializer(many=True, required=True)
-    image = Base64ImageField(required=True)
+    image = LimitedBase64ImageField(required=True)
     tags = serializers.ListField(
-        child=serializers.SlugRelatedField(
-            slug_field='id',
+        child=CachedPrimaryKeyRelatedField(
+            reference=cache.tags,
             queryset=Tag.objects.all(),
         ),
     )
@@ -194,16 +263,7 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             ingredients_data.append(ingredient_id)
         return data
 
-    def ingredient_get_or_create(self, obj, data):
-        new_ingredients = []
-        for elem in data:
-            data, status = (
-                IngredientAmountRecipe.objects.get_or_create(
-                    recipe=obj, **elem)
-            )
-            new_ingredients.append(data)
-        return new_ingredients
-
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
@@ -215,16 +275,46 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                 ingredient=elem.get('ingredient'),
                 amount=elem.get('amount')) for elem in ingredients]
         )
+        TimelineEntry.objects.fan_out(recipe)
+        images.schedule(recipe.pk)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients_data = validated_data.pop('ingredients')
         tags_data = validated_data.pop('tags')
-        ingredients = instance.ingredientamountrecipe_set
-        instance.ingredients.clear()
-        new_ingredients = self.ingredient_get_or_create(
-            instance, ingredients_data)
-        ingredients.set(new_ingredients)
+        existing = {
+            row.ingredient_id: row
+            for row in instance.ingredientamountrecipe_set.all()
+        }
+        amounts = {
+            elem['ingredient'].id: elem['amount']
+            for elem in ingredients_data
+        }
+        ShoppingCartTotal.objects.change_recipe(
+            instance,
+            {ingredient: row.amount for ingredient, row in existing.items()},
+            amounts
+        )
+        removed = [
+            row.pk for ingredient, row in existing.items()
+            if ingredient not in amounts
+        ]
+        if removed:
+            IngredientAmountRecipe.objects.filter(pk__in=removed).delete()
+        IngredientAmountRecipe.objects.bulk_create(
+            [IngredientAmountRecipe(
+                recipe=instance,
+                ingredient_id=ingredient,
+                amount=amount) for ingredient, amount in amounts.items()
+             if ingredient not in existing]
+        )
+        changed = []
+        for ingredient, row in existing.items():
+            if ingredient in amounts and row.amount != amounts[ingredient]:
+                row.amount = amounts[ingredient]
+                changed.append(row)
+        IngredientAmountRecipe.objects.bulk_update(changed, ['amount'])
         instance.tags.set(tags_data)
         instance.name = validated_data.get('name', instance.name)
         instance.text = validated_data.get('text', instance.text)
@@ -233,22 +323,21 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             validated_data.get('cooking_time', instance.cooking_time)
         )
         instance.save()
+        if 'image' in validated_data:
+            images.schedule(instance.pk)
         return instance
 
     def to_representation(self, instance):
+        instance = Recipe.objects.get(pk=instance.pk)
         return RecipeReadSerializer(instance, context=self.context).data
 
 
 class SubscribeSerializer(serializers.ModelSerializer):
     """Сериализатор для подписок."""
-    user = serializers.PrimaryKeyRelatedField(
-        write_only=True,
-        queryset=User.objects.all()
-    )
-    following = serializers.PrimaryKeyRelatedField(
-        write_only=True,
-        queryset=User.objects.all()
-    )
+    self_follow_message = 'Нельзя подписываться на себя.'
+    duplicate_message = 'Вы уже подписаны на этого автора.'
+    recipes_limit_message = (
+        'recipes_limit должен быть неотрицательным целым числом.')
     email = serializers.ReadOnlyField(source='following.email')
     id = serializers.ReadOnlyField(source='following.id')
     username = serializers.ReadOnlyField(source='following.username')
@@ -261,8 +350,6 @@ class SubscribeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Follow
         fields = (
-            'user',
-            'following',
             'email',
             'id',
             'username',
@@ -273,53 +360,58 @@ class SubscribeSerializer(serializers.ModelSerializer):
             'recipes_count'
         )
 
+    @classmethod
+    def recipes_limit(cls, request):
+        """Параметр recipes_limit или None; неверное значение - 400."""
+        value = request.query_params.get('recipes_limit')
+        if not value:
+            return None
+        try:
+            limit = int(value)
+        except ValueError:
+            limit = -1
+        if limit < 0:
+            raise serializers.ValidationError(
+                {'recipes_limit': cls.recipes_limit_message})
+        return limit
+
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.following.recipes.count()
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
-        return Follow.objects.filter(
-            user__username=user,
-            following__username=obj.following.username).exists()
+        if user.is_anonymous:
+            return False
+        return obj.following_id in cache.user_flags.get(user)['follows']
 
     def get_recipes(self, obj):
         queryset = self.context.get('request')
-        recipes_limit = queryset.query_params.get('recipes_limit')
+        if 'recipes' in self.context:
+            return RecipeSerializer(
+                self.context['recipes'].get(obj.following_id, []),
+                many=True, context={'request': queryset}
+            ).data
+        recipes_limit = self.recipes_limit(queryset)
         author = obj.following.id
-        if not recipes_limit:
+        if recipes_limit is None:
             return RecipeSerializer(
                 Recipe.objects.filter(author=author),
                 many=True, context={'request': queryset}
             ).data
         return RecipeSerializer(
-            Recipe.objects.filter(author=author)[:int(recipes_limit)],
+            Recipe.objects.filter(author=author)[:recipes_limit],
             many=True,
             context={'request': queryset}
         ).data
 
-    def validate(self, data):
-        user = data['user']
-        author = data['following']
-        if user == author:
-            raise serializers.ValidationError(
-                'Нельзя подписываться на себя.'
-            )
-        if Follow.objects.filter(
-                user__username=user, following__username=author).exists():
-            raise serializers.ValidationError(
-                'Вы уже подписаны на этого автора.'
-            )
-        return data
-
 
 class FavoriteSerializer(serializers.ModelSerializer):
     """Сериалайзер избранного."""
-    user = serializers.PrimaryKeyRelatedField(
-        write_only=True, queryset=User.objects.all()
-    )
-    recipe = serializers.PrimaryKeyRelatedField(
-        write_only=True, queryset=Recipe.objects.all()
-    )
+    duplicate_message = 'Этот рецепт уже в избранном.'
     id = serializers.ReadOnlyField(source='recipe.id')
     name = serializers.ReadOnlyField(source='recipe.name')
     image = serializers.ImageField(source='recipe.image', read_only=True)
@@ -327,25 +419,12 @@ class FavoriteSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Favorite
-        fields = ('user', 'recipe', 'id', 'name', 'image', 'cooking_time')
-
-    def validate(self, data):
-        user = data['user']
-        recipe = data['recipe']
-        if Favorite.objects.filter(
-                user__username=user, recipe=recipe).exists():
-            raise serializers.ValidationError(
-                'Этот рецепт уже в избранном.'
-            )
-        return data
+        fields = ('id', 'name', 'image', 'cooking_time')
 
 
 class ShopingCartSerializer(serializers.ModelSerializer):
     """Сериализатор добавления в список покупок."""
-    user = serializers.PrimaryKeyRelatedField(
-        write_only=True, queryset=User.objects.all())
-    recipe = serializers.PrimaryKeyRelatedField(
-        write_only=True, queryset=Recipe.objects.all())
+    duplicate_message = 'Этот рецепт уже в списке покупок.'
     id = serializers.ReadOnlyField(source='recipe.id')
     name = serializers.ReadOnlyField(source='recipe.name')
     image = serializers.ImageField(source='recipe.image', read_only=True)
@@ -353,14 +432,4 @@ class ShopingCartSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ShopingCart
-        fields = ('user', 'recipe', 'id', 'name', 'image', 'cooking_time')
-
-    def validate(self, data):
-        user = data['user']
-        recipe = data['recipe']
-        if ShopingCart.objects.filter(
-                user__username=user, recipe=recipe).exists():
-            raise serializers.ValidationError(
-                'Этот рецепт уже в списке покупок.'
-            )
-        return data
+        fields = ('id', 'name', 'image', 'cooking_time')
@@ -0,0 +1,102 @@
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from recipes.images import image_processed
+from recipes.models import (Favorite, Ingredient, Recipe, ShopingCart,
+                            ShoppingCartTotal, Tag, shopping_totals_changed)
+from rest_framework.authtoken.models import Token
+from users.models import Follow, User
+
+from . import cache
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags(**kwargs):
+    """
+    Версия меняется после фиксации: иначе другой процесс успеет
+    перечитать старые строки под новой версией.
+    """
+    transaction.on_commit(cache.tags.invalidate)
+    bump_recipes()
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    transaction.on_commit(cache.ingredients.invalidate)
+    bump_recipes()
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(image_processed)
+def bump_recipes(action='post', **kwargs):
+    """Сброс кэша ответов с рецептами после фиксации транзакции."""
+    if action.startswith('pre'):
+        return
+    transaction.on_commit(lambda: cache.generations.bump('recipes'))
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_from_shopping_lists(instance, **kwargs):
+    """
+    Удаление рецепта через API, админку или вместе с автором:
+    до удаления корзины и ингредиенты рецепта еще на месте.
+    """
+    ShoppingCartTotal.objects.remove_recipe(
+        list(instance.shopping_cart.exclude(user=None)
+             .values_list('user', flat=True)),
+        instance
+    )
+
+
+@receiver(post_save, sender=User)
+def bump_recipes_on_user_change(created=False, update_fields=None,
+                                **kwargs):
+    """Имя или почта автора есть в представлении рецепта."""
+    if created:
+        return
+    if update_fields is None or set(update_fields) - {'last_login'}:
+        bump_recipes()
+        transaction.on_commit(lambda: cache.generations.bump('users'))
+
+
+@receiver(post_save, sender=User)
+def invalidate_tokens_on_user_change(created=False, update_fields=None,
+                                     **kwargs):
+    """Деактивация, смена пароля или данных пользователя."""
+    if created:
+        return
+    if update_fields is None or set(update_fields) - {'last_login'}:
+        transaction.on_commit(cache.tokens.invalidate)
+
+
+@receiver(post_delete, sender=Token)
+def revoke_token(instance, **kwargs):
+    """Выход через djoser удаляет токен пользователя."""
+    transaction.on_commit(lambda: cache.tokens.revoke(instance.key))
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+def bump_favorites(**kwargs):
+    transaction.on_commit(lambda: cache.generations.bump('favorites'))
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShopingCart)
+@receiver((post_save, post_delete), sender=Follow)
+def invalidate_user_flags(instance, **kwargs):
+    if instance.user_id is not None:
+        transaction.on_commit(
+            lambda: cache.user_flags.invalidate(instance.user_id))
+
+
+@receiver(shopping_totals_changed)
+def bump_shopping_lists(user_ids, **kwargs):
+    """Версии списков покупок для ETag при загрузке."""
+    if user_ids is None:
+        transaction.on_commit(
+            lambda: cache.generations.bump('shopping-lists'))
+    else:
+        transaction.on_commit(lambda: cache.generations.renew(
+            [f'shopping-list:{user}' for user in user_ids]))
@@ -0,0 +1,77 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from recipes.models import (Ingredient, IngredientAmountRecipe, Recipe,
+                            ShopingCart, ShoppingCartTotal, Tag)
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import User
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RecipeUpdateQueriesTest(TestCase):
+    """Число запросов при изменении рецепта не зависит от ингредиентов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password-12345')
+        cls.token = Token.objects.create(user=cls.user)
+        cls.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(60))
+        cls.ingredients = list(Ingredient.objects.order_by('id'))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def create_recipe(self, size):
+        recipe = Recipe.objects.create(
+            author=self.user, name=f'Рецепт {size}', text='Текст',
+            cooking_time=10, image='recipe/image.png')
+        recipe.tags.set([self.tag])
+        IngredientAmountRecipe.objects.bulk_create(
+            IngredientAmountRecipe(recipe=recipe, ingredient=ingredient,
+                                   amount=1)
+            for ingredient in self.ingredients[:size])
+        ShopingCart.objects.create(user=self.user, recipe=recipe)
+        ShoppingCartTotal.objects.add_recipe([self.user.id], recipe)
+        return recipe
+
+    def update(self, recipe, size):
+        # Треть ингредиентов удаляется, треть меняет количество,
+        # треть добавляется.
+        step = size // 3
+        response = self.client.patch(
+            f'/api/recipes/{recipe.pk}/',
+            {
+                'ingredients': [
+                    {'id': ingredient.id, 'amount': 2}
+                    for ingredient in self.ingredients[step:size + step]
+                ],
+                'tags': [self.tag.id],
+                'cooking_time': 5,
+            },
+            format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response
+
+    def test_update_queries_do_not_depend_on_ingredients(self):
+        self.update(self.create_recipe(3), 3)
+        small = self.create_recipe(3)
+        large = self.create_recipe(30)
+        with CaptureQueriesContext(connection) as queries:
+            self.update(small, 3)
+        with self.assertNumQueries(len(queries)):
+            response = self.update(large, 30)
+        self.assertEqual(len(response.data['ingredients']), 30)
+        self.assertEqual(
+            dict(ShoppingCartTotal.objects.filter(
+                user=self.user, ingredient__in=self.ingredients[30:40]
+            ).values_list('ingredient', 'total')),
+            {ingredient.id: 2 for ingredient in self.ingredients[30:40]})
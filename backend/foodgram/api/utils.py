@@ -1,24 +1,53 @@
-from django.db.models import Sum
-from django.http import HttpResponse
-from recipes.models import IngredientAmountRecipe
+from hashlib import md5
+
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from recipes.models import ShoppingCartTotal
+
+from . import cache
+
+CHUNK_SIZE = 2000
 
 
 def download_shopp_cart(request):
     """
     Загрузка списка покупок.
+    Формат выбирается параметром format (txt, csv, json),
+    строки читаются курсором из сумм ShoppingCartTotal
+    и отдаются потоком. Под ASGI поток читается в цикле событий,
+    где ORM недоступен, поэтому файл собирается заранее.
+    ETag строится по версии списка пользователя, которая
+    меняется при любом изменении его сумм, и версии
+    справочника ингредиентов.
     """
-    ingredients = IngredientAmountRecipe.objects.filter(
-        recipe__shopping_cart__user=request.user).values(
-        'ingredient__name',
-        'ingredient__measurement_unit').annotate(total=Sum('amount'))
-    shopping_list = 'Список покупок:\n\n'
-    for number, ingredient in enumerate(ingredients, start=1):
-        shopping_list += (
-            f'{ingredient["ingredient__name"]}: '
-            f'{ingredient["total"]} '
-            f'{ingredient["ingredient__measurement_unit"]}\n')
-    cart = 'shopping-list.txt'
-    response = HttpResponse(shopping_list, content_type='text/plain')
+    renderer = request.accepted_renderer
+    versions = (
+        renderer.format, cache.ingredients.version(),
+        *cache.generations.get((
+            'shopping-lists', f'shopping-list:{request.user.pk}')),
+    )
+    etag = md5(repr(versions).encode()).hexdigest()
+    response = get_conditional_response(request, etag=f'"{etag}"')
+    if response is not None:
+        return response
+    rows = ShoppingCartTotal.objects.filter(
+        user=request.user
+    ).values_list(
+        'ingredient__name', 'ingredient__measurement_unit', 'total'
+    ).order_by('ingredient__name', 'ingredient__measurement_unit')
+    content = renderer.stream(
+        {'name': name, 'total': total, 'measurement_unit': unit}
+        for name, unit, total in rows.iterator(chunk_size=CHUNK_SIZE)
+    )
+    if isinstance(request._request, ASGIRequest):
+        content = list(content)
+    response = StreamingHttpResponse(
+        content,
+        content_type=f'{renderer.media_type}; charset={renderer.charset}'
+    )
+    cart = f'shopping-list.{renderer.format}'
     response['Content-Disposition'] = (f'attachment;'
                                        f'filename={cart}')
+    response['ETag'] = f'"{etag}"'
     return response
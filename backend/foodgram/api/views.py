@@ -1,15 +1,28 @@
+from collections import defaultdict
+from hashlib import md5
+
+from django.db import IntegrityError, transaction
+from django.db.models import (BooleanField, Count, Exists, Max, OuterRef,
+                              Subquery, Value)
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from recipes.models import Favorite, Ingredient, Recipe, ShopingCart, Tag
+from recipes.models import (Favorite, Ingredient, Recipe, ShopingCart,
+                            ShoppingCartTotal, Tag, TimelineEntry)
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from users.models import Follow, User
 
+from . import cache, metrics, replicas
 from .filters import IngredientSearchFilter, RecipeFilter
-from .pagination import CustomPagination
+from .pagination import CustomPagination, FeedPagination
 from .permissions import AuthorOrAdminOrReadOnly
+from .renderers import SHOPPING_LIST_RENDERERS
 from .serializers import (FavoriteSerializer, IngredientSerializer,
                           RecipeReadSerializer, RecipeWriteSerializer,
                           ShopingCartSerializer, SubscribeSerializer,
@@ -22,73 +35,330 @@ class CustomUserViewSet(UserViewSet):
     queryset = User.objects.all()
     pagination_class = CustomPagination
 
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_anonymous:
+            is_subscribed = Value(False, BooleanField())
+        else:
+            is_subscribed = Exists(Follow.objects.filter(
+                user=user, following=OuterRef('pk')))
+        return super().get_queryset().annotate(
+            is_subscribed=is_subscribed).order_by('id')
+
     @action(
         detail=False,
         methods=['get'],
         permission_classes=(AuthorOrAdminOrReadOnly,))
     def subscriptions(self, request):
-        queryset = request.user.follower.all()
-        context = {'request': request}
+        queryset = Follow.objects.for_subscriptions(request.user)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = SubscribeSerializer(
-                page, context=context, many=True)
+                page, context=self._subscriptions_context(request, page),
+                many=True)
             return self.get_paginated_response(serializer.data)
 
-        serializer = SubscribeSerializer(queryset, many=True)
+        serializer = SubscribeSerializer(
+            queryset, context=self._subscriptions_context(request, queryset),
+            many=True)
         return Response(serializer.data)
 
+    def _subscriptions_context(self, request, follows):
+        """Рецепты авторов из подписок одним запросом."""
+        recipes_limit = SubscribeSerializer.recipes_limit(request)
+        recipes = Recipe.objects.only(
+            'id', 'author', 'name', 'image', 'image_variants',
+            'cooking_time', 'created'
+        ).latest_by_authors(
+            [follow.following_id for follow in follows], recipes_limit
+        )
+        grouped = defaultdict(list)
+        for recipe in recipes:
+            grouped[recipe.author_id].append(recipe)
+        return {'request': request, 'recipes': grouped}
+
     @action(detail=True, methods=['post', 'delete'])
     def subscribe(self, request, id):
-        user = request.user.pk
-        author = get_object_or_404(User, pk=id)
-        data = {'user': user, 'following': author.id}
-        context = {'request': request}
-        serializer = SubscribeSerializer(data=data, context=context)
+        user = request.user
         if request.method == 'POST':
+            author = get_object_or_404(User, pk=id)
+            SubscribeSerializer.recipes_limit(request)
+            if author.pk == user.pk:
+                return _error(SubscribeSerializer.self_follow_message)
             try:
-                serializer.is_valid()
-                serializer.save()
-                return Response(serializer.data)
-            except:
-                return Response(
-                    serializer.errors,
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+                with transaction.atomic():
+                    follow = Follow.objects.create(
+                        user=user, following=author)
+                    TimelineEntry.objects.backfill(user, author)
+            except IntegrityError:
+                return _error(SubscribeSerializer.duplicate_message)
+            follow.is_subscribed = True
+            return Response(SubscribeSerializer(
+                follow, context={'request': request}).data)
         if request.method == 'DELETE':
-            subscription = Follow.objects.filter(
-                user=user, following=author)
-            if subscription:
-                subscription.delete()
+            with transaction.atomic():
+                deleted, _ = Follow.objects.filter(
+                    user=user, following_id=id).delete()
+                if deleted:
+                    TimelineEntry.objects.prune(user, id)
+            if deleted:
                 return Response(status=status.HTTP_204_NO_CONTENT)
+            get_object_or_404(User.objects.only('id'), pk=id)
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+def _error(message):
+    return Response(
+        {api_settings.NON_FIELD_ERRORS_KEY: [message]},
+        status=status.HTTP_400_BAD_REQUEST
+    )
+
+
+def _create_once(model, **fields):
+    """
+    Вставка строки в отдельной точке сохранения: при повторе
+    откатывается только она, а не вся транзакция. None, если
+    строка уже есть.
+    """
+    try:
+        with transaction.atomic():
+            return model.objects.create(**fields)
+    except IntegrityError:
+        return None
+
+
+def _user_state(model, field, function):
+    return Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(value=function).values('value')
+    )
+
+
+def user_flags_version(user):
+    """
+    Состояние избранного, списка покупок и подписок пользователя
+    одним запросом.
+    """
+    if user.is_anonymous:
+        return ()
+    return User.objects.filter(pk=user.pk).values_list(
+        _user_state(Favorite, 'user', Count('id')),
+        _user_state(Favorite, 'user', Max('id')),
+        _user_state(ShopingCart, 'user', Count('id')),
+        _user_state(ShopingCart, 'user', Max('id')),
+        _user_state(Follow, 'user', Count('id')),
+        _user_state(Follow, 'user', Max('id')),
+    ).first()
+
+
+class ConditionalGetMixin:
+    """
+    Условные GET-запросы: ETag и Last-Modified считаются
+    дешевым запросом и проверяются до сериализации.
+    """
+
+    def list_validators(self, request):
+        return None, None
+
+    def object_validators(self, request, **kwargs):
+        return None, None
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional(
+            request, self.list_validators(request),
+            super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional(
+            request, self.object_validators(request, **kwargs),
+            super().retrieve, *args, **kwargs)
+
+    def _conditional(self, request, validators, handler, *args, **kwargs):
+        state, last_modified = validators
+        if state is None:
+            return handler(request, *args, **kwargs)
+        etag = 'W/"{}"'.format(md5(
+            f'{request.accepted_renderer.format}:{state}'.encode()
+        ).hexdigest())
+        timestamp = (
+            int(last_modified.timestamp()) if last_modified else None)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+
+class AnonymousResponseCacheMixin:
+    """
+    Готовые ответы анонимным пользователям из общего кэша.
+    Ключ - адрес с упорядоченными параметрами, формат ответа
+    и поколения данных, от которых ответ зависит.
+    """
+    cache_generations = ()
+
+    def get_cache_generations(self, request):
+        return self.cache_generations
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response(
+            request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_response(
+            request, super().retrieve, *args, **kwargs)
+
+    def _cached_response(self, request, handler, *args, **kwargs):
+        if not request.user.is_anonymous:
+            return handler(request, *args, **kwargs)
+        endpoint = request.resolver_match.view_name
+        key = cache.responses.key(request, cache.generations.get(
+            self.get_cache_generations(request)))
+        cached = cache.responses.get(key)
+        if cached is None:
+            metrics.response_cache.inc(result='miss', endpoint=endpoint)
+            # Ответ попадет в общий кэш: читаем с основной базы.
+            with replicas.primary():
+                response = handler(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                request.response_cache_key = key
+            return response
+        metrics.response_cache.inc(result='hit', endpoint=endpoint)
+        response = get_conditional_response(
+            request, etag=cached['etag'],
+            last_modified=parse_http_date_safe(cached['last_modified'])
+        ) or HttpResponse(
+            cached['content'], content_type=cached['content_type'])
+        if cached['etag']:
+            response['ETag'] = cached['etag']
+        if cached['last_modified']:
+            response['Last-Modified'] = cached['last_modified']
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs)
+        key = getattr(request, 'response_cache_key', None)
+        if key is not None and isinstance(response, Response):
+            response.add_post_render_callback(
+                lambda rendered: cache.responses.set(key, rendered))
+        return response
+
+
+class ReferenceCacheMixin:
+    """
+    Чтение справочника из кэша процесса.
+    Список без фильтров отдается готовым JSON.
+    """
+    reference = None
+
+    def list(self, request, *args, **kwargs):
+        if set(request.query_params) - {'format'}:
+            return super().list(request, *args, **kwargs)
+        if request.accepted_renderer.format == 'json':
+            return HttpResponse(
+                self.reference.content(self.get_serializer_class()),
+                content_type='application/json'
+            )
+        serializer = self.get_serializer(self.reference.all(), many=True)
+        return Response(serializer.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            obj = self.reference.get(int(kwargs[self.lookup_field]))
+        except ValueError:
+            obj = None
+        if obj is None:
+            raise Http404
+        return Response(self.get_serializer(obj).data)
+
+
+class ReferenceViewSet(ConditionalGetMixin, ReferenceCacheMixin,
+                       viewsets.ReadOnlyModelViewSet):
+    """Справочник из кэша с проверкой версии по ETag."""
+
+    def list_validators(self, request):
+        return self.reference.version(), None
+
+    def object_validators(self, request, **kwargs):
+        return self.reference.version(), None
+
+
+class TagViewSet(ReferenceViewSet):
     """Получение тегов."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    reference = cache.tags
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ReferenceViewSet):
     """Получение ингредиентов."""
     queryset = Ingredient.objects.all()
+    reference = cache.ingredients
     serializer_class = IngredientSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientSearchFilter
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(AnonymousResponseCacheMixin, ConditionalGetMixin,
+                    viewsets.ModelViewSet):
     """Создание и получение рецепта.
     Добавление в избранное, удаление.
     Добавление в список покупок, удаление и скачивание списка."""
     queryset = Recipe.objects.all()
+    cache_generations = ('recipes',)
     pagination_class = CustomPagination
     serializer_class = RecipeReadSerializer
     permission_classes = (AuthorOrAdminOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_cache_generations(self, request):
+        if request.query_params.get('ordering') == 'popular':
+            return ('recipes', 'favorites')
+        return self.cache_generations
+
+    def list_validators(self, request):
+        state = self.filter_queryset(Recipe.objects.all()).order_by(
+        ).aggregate(last=Max('updated_at'), count=Count('id'))
+        popularity = None
+        if request.query_params.get('ordering') == 'popular':
+            popularity = Favorite.objects.aggregate(
+                count=Count('id'), last=Max('id'))
+        return (
+            (state['last'], state['count'], popularity,
+             user_flags_version(request.user),
+             cache.tags.version(), cache.ingredients.version(),
+             cache.generations.get(('users',))),
+            state['last']
+        )
+
+    def object_validators(self, request, **kwargs):
+        try:
+            state = Recipe.objects.for_feed(request.user).filter(
+                pk=kwargs[self.lookup_field]
+            ).values_list(
+                'updated_at', 'is_favorited', 'is_in_shopping_cart',
+                'author_is_subscribed'
+            ).first()
+        except (TypeError, ValueError):
+            # Некорректный id: 404 вернет get_object.
+            return None, None
+        if state is None:
+            return None, None
+        return (
+            (state, cache.tags.version(), cache.ingredients.version(),
+             cache.generations.get(('users',))),
+            state[0]
+        )
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
@@ -112,30 +382,60 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def shopping_cart(self, request, pk=None):
         return self._logic_favorite_shopping_cart(
             request, pk, Recipe, ShopingCart, ShopingCartSerializer)
-    """список скачивается , но нельзя удалить и не видны данные на страницы.
-    Не могу решить"""
-    @action(detail=False, permission_classes=(permissions.IsAuthenticated,))
+
+    @action(
+        detail=False,
+        permission_classes=(permissions.IsAuthenticated,),
+        pagination_class=FeedPagination)
+    def feed(self, request):
+        """Рецепты авторов из подписок, новые сначала."""
+        page = self.paginate_queryset(
+            TimelineEntry.objects.filter(user=request.user))
+        serializer = RecipeReadSerializer(
+            page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        permission_classes=(permissions.IsAuthenticated,),
+        renderer_classes=SHOPPING_LIST_RENDERERS)
     def download_shopping_cart(self, request):
         return download_shopp_cart(request)
 
     def _logic_favorite_shopping_cart(
             self, request, pk, model_recipe, model, serializer):
+        """
+        Добавление и удаление одним запросом на запись:
+        повтор отсекается уникальным ограничением в базе.
+        """
         user = request.user.id
-        recipe = get_object_or_404(model_recipe, pk=pk)
-        data = {'user': user, 'recipe': recipe.id}
-        context = {'request': request}
-        serializer = serializer(data=data, context=context)
+        counter = (
+            'in_carts_count' if model is ShopingCart else 'favorites_count')
         if request.method == 'POST':
-            try:
-                serializer.is_valid()
-                serializer.save()
-                return Response(serializer.data)
-            except:
-                return Response(
-                    serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            recipe = get_object_or_404(
+                model_recipe.objects.only(
+                    'id', 'name', 'image', 'cooking_time'),
+                pk=pk)
+            with transaction.atomic():
+                relation = _create_once(model, user_id=user, recipe=recipe)
+                if relation is not None:
+                    Recipe.objects.change_counter(recipe.pk, counter, 1)
+                    if model is ShopingCart:
+                        ShoppingCartTotal.objects.add_recipe([user], recipe)
+            if relation is None:
+                return _error(serializer.duplicate_message)
+            return Response(
+                serializer(relation, context={'request': request}).data)
         if request.method == 'DELETE':
-            favorite = model.objects.filter(user=user, recipe=recipe)
-            if favorite:
-                favorite.delete()
+            with transaction.atomic():
+                deleted, _ = model.objects.filter(
+                    user_id=user, recipe_id=pk).delete()
+                if deleted:
+                    Recipe.objects.change_counter(pk, counter, -deleted)
+                    if model is ShopingCart:
+                        ShoppingCartTotal.objects.remove_recipe(
+                            [user], model_recipe(pk=pk))
+            if deleted:
                 return Response(status=status.HTTP_204_NO_CONTENT)
+            get_object_or_404(model_recipe.objects.only('id'), pk=pk)
             return Response(status=status.HTTP_400_BAD_REQUEST)
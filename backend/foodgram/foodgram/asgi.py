@@ -1,7 +1,40 @@
+import asyncio
 import os
 
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.conf import settings
 from django.core.asgi import get_asgi_application
+from django.db import connections
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
-application = get_asgi_application()
+
+class ThreadPerRequest:
+    """
+    Django 3.2 выполняет синхронные представления под ASGI в одном
+    общем потоке процесса, и запросы идут по очереди. Здесь каждый
+    HTTP-запрос получает свой поток со своим соединением с БД,
+    соединение закрывается в конце запроса. Одновременно
+    обрабатывается не больше limit запросов.
+    """
+
+    def __init__(self, application, limit):
+        self.application = application
+        self.limit = limit
+        self._slots = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.application(scope, receive, send)
+            return
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.limit)
+        async with self._slots, ThreadSensitiveContext():
+            try:
+                await self.application(scope, receive, send)
+            finally:
+                await sync_to_async(connections.close_all)()
+
+
+application = ThreadPerRequest(
+    get_asgi_application(), settings.ASGI_MAX_CONCURRENCY)
@@ -0,0 +1,46 @@
+import time
+
+from api import metrics
+from django.db.backends.postgresql import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL с проверкой постоянных соединений и метриками.
+    При первом обращении к базе в запросе соединение, оставшееся
+    от прошлых запросов, проверяется через SELECT 1, если в
+    настройках базы включен CONN_HEALTH_CHECKS (как в Django 4.1).
+    Неисправное соединение закрывается и открывается заново.
+    """
+    health_check_done = False
+
+    def connect(self):
+        self.health_check_done = True
+        start = time.perf_counter()
+        super().connect()
+        metrics.db_connect_duration.observe(
+            time.perf_counter() - start, alias=self.alias)
+        metrics.db_connections.inc(alias=self.alias, event='opened')
+
+    def _cursor(self, name=None):
+        if self.connection is not None and not self.health_check_done:
+            self.health_check_done = True
+            if (self.settings_dict.get('CONN_HEALTH_CHECKS')
+                    and not self.in_atomic_block and not self.is_usable()):
+                metrics.db_connections.inc(
+                    alias=self.alias, event='health_check_failed')
+                self.close()
+            else:
+                metrics.db_connections.inc(alias=self.alias, event='reused')
+        return super()._cursor(name)
+
+    def close(self):
+        opened = self.connection is not None
+        super().close()
+        if opened and self.connection is None:
+            metrics.db_connections.inc(alias=self.alias, event='closed')
+
+    def close_if_unusable_or_obsolete(self):
+        """Вызывается в начале и в конце каждого запроса."""
+        self.health_check_done = False
+        super().close_if_unusable_or_obsolete()
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'django_extensions',
     'rest_framework.authtoken',
@@ -52,6 +53,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.QueryStatsMiddleware',
+    'api.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,6 +88,14 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# Соединения живут DB_CONN_MAX_AGE секунд и проверяются перед
+# повторным использованием. PostgreSQL подключается через
+# foodgram.db: та же база с проверкой соединений и метриками.
+# DB_PGBOUNCER=true - режим для pgbouncer с пулом транзакций:
+# без серверных курсоров, которые живут дольше транзакции.
+# Под ASGI соединение закрывается в конце каждого запроса.
+DB_PGBOUNCER = os.getenv('DB_PGBOUNCER', default='false').lower() == 'true'
+
 DATABASES = {
     'default': {
         # 'ENGINE': 'django.db.backends.sqlite3',
@@ -94,9 +105,65 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='postgres'),
         'HOST': os.getenv('DB_HOST', default='db'),
-        'PORT': os.getenv('DB_PORT', default='5432')
+        'PORT': os.getenv('DB_PORT', default='5432'),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
+        'CONN_HEALTH_CHECKS': True,
+        'DISABLE_SERVER_SIDE_CURSORS': DB_PGBOUNCER,
     }
 }
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    DATABASES['default']['ENGINE'] = 'foodgram.db'
+
+# Реплики для чтения: DB_REPLICAS - через запятую host:port/имя_базы
+# для PostgreSQL (любая часть может быть опущена) или файлы для
+# SQLite, остальное как у default.
+# В тестах реплики указывают на тестовую основную базу.
+REPLICA_DATABASES = []
+for number, replica in enumerate(
+        filter(None, os.getenv('DB_REPLICAS', default='').split(',')), 1):
+    config = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if config['ENGINE'] == 'django.db.backends.sqlite3':
+        config['NAME'] = replica.strip()
+    else:
+        address, _, name = replica.strip().partition('/')
+        host, _, port = address.partition(':')
+        config.update(
+            HOST=host or config['HOST'], PORT=port or config['PORT'],
+            NAME=name or config['NAME'])
+    DATABASES[f'replica{number}'] = config
+    REPLICA_DATABASES.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+
+REPLICA_STICKY_SECONDS = int(
+    os.getenv('DB_REPLICA_STICKY_SECONDS', default=10))
+
+# Кэш пользователей по токену: размер LRU в процессе, время жизни
+# записи и хранение в общем кэше между процессами.
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', default=10000))
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', default=60))
+TOKEN_CACHE_SHARED = (
+    os.getenv('TOKEN_CACHE_SHARED', default='false').lower() == 'true')
+
+# Общий для всех процессов кэш: по умолчанию файловый,
+# для нескольких серверов - memcached через CACHE_BACKEND.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION', default='/tmp/foodgram-cache'),
+        'TIMEOUT': int(os.getenv('CACHE_TIMEOUT', default=300)),
+    }
+}
+if 'memcached' not in CACHES['default']['BACKEND']:
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', default=10000)),
+    }
+
+RESPONSE_CACHE_TIMEOUT = int(
+    os.getenv('RESPONSE_CACHE_TIMEOUT', default=300))
 
 
 # Password validation
@@ -155,15 +222,42 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
     ],
+
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.LimitedJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 
+QUERY_STATS_N_PLUS_ONE_THRESHOLD = int(
+    os.getenv('QUERY_STATS_N_PLUS_ONE_THRESHOLD', default=10))
+
+IMAGE_PROCESSING_WORKERS = int(
+    os.getenv('IMAGE_PROCESSING_WORKERS', default=2))
+
+API_MAX_JSON_BODY_SIZE = int(
+    os.getenv('API_MAX_JSON_BODY_SIZE', default=8 * 1024 * 1024))
+
+RECIPE_IMAGE_MAX_SIZE = int(
+    os.getenv('RECIPE_IMAGE_MAX_SIZE', default=5 * 1024 * 1024))
+
+RECIPE_IMAGE_MAX_DIMENSION = int(
+    os.getenv('RECIPE_IMAGE_MAX_DIMENSION', default=6000))
+
+FEED_FANOUT_MAX_FOLLOWERS = int(
+    os.getenv('FEED_FANOUT_MAX_FOLLOWERS', default=1000))
+
+FEED_BACKFILL_LIMIT = int(os.getenv('FEED_BACKFILL_LIMIT', default=100))
+
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'HIDE_USERS': False,
@@ -177,3 +271,5 @@ DJOSER = {
         'current_user': 'api.serializers.UserSerializer',
     },
 }
+
+ASGI_MAX_CONCURRENCY = int(os.getenv('ASGI_MAX_CONCURRENCY', default=32))
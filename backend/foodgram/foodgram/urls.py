@@ -1,7 +1,9 @@
+from api.metrics import metrics
 from django.contrib import admin
 from django.urls import include, path
 
 urlpatterns = [
     path('api/', include('api.urls')),
     path('admin/', admin.site.urls),
+    path('metrics/', metrics),
 ]
@@ -24,13 +24,17 @@ class IngredientInline(admin.TabularInline):
 class RecipeAdmin(admin.ModelAdmin):
     """Админ панель рецепта."""
     inlines = (IngredientInline,)
-    list_display = ('name', 'author', 'count_recipes_favorite')
+    list_display = (
+        'name', 'author', 'count_recipes_favorite', 'in_carts_count')
     list_filter = ('author', 'name', 'tags')
+    list_select_related = ('author',)
+    readonly_fields = ('favorites_count', 'in_carts_count')
 
     def count_recipes_favorite(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
 
     count_recipes_favorite.short_description = 'количество в избранном'
+    count_recipes_favorite.admin_order_field = 'favorites_count'
 
 
 class IngredientAdmin(admin.ModelAdmin):
@@ -0,0 +1,134 @@
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = 'recipe/'
+# Имя варианта: (размер, формат, обрезать до точного размера).
+VARIANTS = {
+    'thumbnail': ((480, 480), 'JPEG', True),
+    'thumbnail_webp': ((480, 480), 'WEBP', True),
+    'webp': ((1280, 1280), 'WEBP', False),
+}
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'WEBP': {'quality': 80, 'method': 4},
+    'PNG': {'optimize': True},
+}
+
+# Отправляется после замены картинки рецепта обработанной.
+image_processed = Signal()
+
+_executor = None
+_lock = threading.Lock()
+
+
+def schedule(recipe_id):
+    """
+    Обработка картинки рецепта после фиксации транзакции:
+    в фоновом потоке или сразу, если потоков 0.
+    """
+    transaction.on_commit(lambda: _submit(recipe_id))
+
+
+def _submit(recipe_id):
+    global _executor
+    workers = getattr(settings, 'IMAGE_PROCESSING_WORKERS', 2)
+    if not workers:
+        _process(recipe_id)
+        return
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix='recipe-images')
+    _executor.submit(_process, recipe_id, True)
+
+
+def _process(recipe_id, threaded=False):
+    try:
+        process_recipe_image(recipe_id)
+    except Exception:
+        logger.exception('Не удалось обработать картинку рецепта %s',
+                         recipe_id)
+    finally:
+        if threaded:
+            connections.close_all()
+
+
+def process_recipe_image(recipe_id):
+    """
+    Убирает метаданные из оригинала и создает уменьшенные
+    варианты. Имена файлов строятся по хешу содержимого,
+    одинаковые картинки хранятся один раз.
+    """
+    name = Recipe.objects.filter(pk=recipe_id).values_list(
+        'image', flat=True).first()
+    if not name:
+        return False
+    with default_storage.open(name) as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()[:32]
+    image = Image.open(io.BytesIO(content))
+    image_format = image.format if image.format in EXTENSIONS else 'PNG'
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGBA')
+
+    original = _store(
+        f'{UPLOAD_DIR}{digest}.{EXTENSIONS[image_format]}',
+        image, image_format)
+    variants = {}
+    for variant, (size, variant_format, crop) in VARIANTS.items():
+        if crop:
+            resized = ImageOps.fit(
+                image, size, Image.Resampling.LANCZOS)
+        else:
+            resized = image.copy()
+            resized.thumbnail(size, Image.Resampling.LANCZOS)
+        variants[variant] = _store(
+            f'{UPLOAD_DIR}{digest}_{variant}.'
+            f'{EXTENSIONS[variant_format]}',
+            resized, variant_format)
+
+    updated = Recipe.objects.filter(pk=recipe_id, image=name).update(
+        image=original, image_variants=variants, updated_at=timezone.now())
+    if not updated:
+        return False
+    if original != name:
+        default_storage.delete(name)
+    image_processed.send(sender=Recipe, recipe_id=recipe_id)
+    return True
+
+
+def _store(name, image, image_format):
+    """Сохраняет картинку без метаданных, если файла еще нет."""
+    if default_storage.exists(name):
+        return name
+    if image_format == 'JPEG':
+        image = _flatten(image)
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **SAVE_OPTIONS.get(image_format, {}))
+    return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def _flatten(image):
+    """RGB на белом фоне для форматов без прозрачности."""
+    if image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
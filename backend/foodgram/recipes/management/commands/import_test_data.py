@@ -1,27 +1,92 @@
 import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from api import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from recipes.models import Ingredient
 
 
 class Command(BaseCommand):
     """
-    Команда 'import_test_data' проводит миграции и
-    загружает тестовые данные в базу из csv файлов.
+    Команда 'import_test_data' загружает ингредиенты в базу
+    из csv или json файла пачками в одной транзакции.
+    Повторная загрузка того же файла ничего не меняет.
     """
-    def handle(self, *args, **options):
-        self.import_ingredient()
+    help = 'Загрузка ингредиентов из csv или json.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default='data/ingredients.csv',
+            help='Файл с ингредиентами (.csv или .json).'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество строк в одном запросе.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Загрузить и откатить транзакцию.'
+        )
 
-        print('Загрузка тестовых данных завершена.')
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'Файл {path} не найден.')
+        if options['batch_size'] < 1:
+            raise CommandError('Размер пачки должен быть положительным.')
+        self.verbosity = options['verbosity']
+        self.stdout.write(f'Загрузка {path}...')
+        start = time.monotonic()
+        with transaction.atomic():
+            before = Ingredient.objects.count()
+            rows = self.import_ingredient(
+                self.read(path), options['batch_size'], start)
+            created = Ingredient.objects.count() - before
+            if options['dry_run']:
+                transaction.set_rollback(True)
+        elapsed = time.monotonic() - start
+        if not options['dry_run']:
+            cache.ingredients.invalidate()
+        self.stdout.write(
+            f'Обработано строк: {rows}, новых ингредиентов: {created}, '
+            f'{elapsed:.2f} с ({rows / max(elapsed, 1e-6):.0f} строк/с).'
+        )
+        if options['dry_run']:
+            self.stdout.write('Пробный запуск: изменения отменены.')
+        else:
+            self.stdout.write('Загрузка тестовых данных завершена.')
 
-    def import_ingredient(self, file='ingredients.csv'):
-        print(f'Загрузка {file}...')
-        file_path = f'data/{file}'
-        with open(file_path, newline='', encoding='utf-8') as f:
-            fieldnames = ['name', 'measurement_unit']
-            reader = csv.DictReader(f, fieldnames=fieldnames)
-            for row in reader:
-                status, created = Ingredient.objects.update_or_create(
+    def read(self, path):
+        with open(path, newline='', encoding='utf-8') as f:
+            if path.suffix == '.json':
+                rows = json.load(f)
+            else:
+                rows = csv.DictReader(
+                    f, fieldnames=['name', 'measurement_unit'])
+            for row in rows:
+                yield Ingredient(
                     name=row['name'],
                     measurement_unit=row['measurement_unit']
                 )
+
+    def import_ingredient(self, ingredients, batch_size, start):
+        rows = 0
+        while True:
+            batch = list(islice(ingredients, batch_size))
+            if not batch:
+                return rows
+            Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+            rows += len(batch)
+            if self.verbosity > 1:
+                elapsed = time.monotonic() - start
+                self.stdout.write(
+                    f'  {rows} строк, '
+                    f'{rows / max(elapsed, 1e-6):.0f} строк/с')
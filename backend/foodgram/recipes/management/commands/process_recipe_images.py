@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from recipes.images import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """
+    Команда 'process_recipe_images' создает уменьшенные варианты
+    картинок для рецептов, у которых их еще нет: после переноса
+    базы или если фоновая обработка не успела завершиться.
+    С флагом --all обрабатывает все рецепты.
+    """
+    help = 'Обработка картинок рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Обработать все рецепты, а не только без вариантов.'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.order_by('pk')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        processed = failed = 0
+        for pk in recipes.values_list('pk', flat=True).iterator():
+            try:
+                if process_recipe_image(pk):
+                    processed += 1
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'Рецепт {pk}: {error}')
+        self.stdout.write(
+            f'Обработано рецептов: {processed}, ошибок: {failed}.')
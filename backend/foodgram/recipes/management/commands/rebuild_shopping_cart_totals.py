@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.models import ShoppingCartTotal
+
+
+class Command(BaseCommand):
+    """
+    Команда 'rebuild_shopping_cart_totals' пересчитывает суммы
+    списков покупок по рецептам в корзинах.
+    С флагом --verify только сверяет суммы и ничего не меняет.
+    """
+    help = 'Пересчет сумм списков покупок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только проверить расхождения.'
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            return self.verify()
+        with transaction.atomic():
+            ShoppingCartTotal.objects.rebuild()
+        self.stdout.write(
+            f'Пересчитано строк: {ShoppingCartTotal.objects.count()}.')
+
+    def verify(self):
+        expected = {
+            (row['recipe__shopping_cart__user'], row['ingredient']):
+                row['total']
+            for row in ShoppingCartTotal.objects.expected().iterator()
+        }
+        actual = {
+            (user, ingredient): total
+            for user, ingredient, total in ShoppingCartTotal.objects
+            .values_list('user', 'ingredient', 'total').iterator()
+        }
+        mismatched = [
+            key for key in expected.keys() | actual.keys()
+            if expected.get(key) != actual.get(key)
+        ]
+        for user, ingredient in mismatched[:20]:
+            self.stdout.write(
+                f'Пользователь {user}, ингредиент {ingredient}: '
+                f'ожидается {expected.get((user, ingredient))}, '
+                f'в таблице {actual.get((user, ingredient))}'
+            )
+        if mismatched:
+            raise CommandError(f'Расхождений: {len(mismatched)}.')
+        self.stdout.write('Суммы списков покупок согласованы.')
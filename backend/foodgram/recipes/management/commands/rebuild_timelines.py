@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.models import TimelineEntry
+
+
+class Command(BaseCommand):
+    """
+    Команда 'rebuild_timelines' заново решает, какие рецепты
+    рассылать по лентам подписчиков, и пересчитывает ленты.
+    С флагом --verify только сверяет ленты и ничего не меняет.
+    """
+    help = 'Пересчет лент подписок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только проверить расхождения.'
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            return self.verify()
+        with transaction.atomic():
+            TimelineEntry.objects.rebuild()
+        self.stdout.write(
+            f'Пересчитано записей: {TimelineEntry.objects.count()}.')
+
+    def verify(self):
+        expected = {
+            (user, recipe)
+            for user, recipe, *_ in TimelineEntry.objects.expected()
+            .iterator()
+        }
+        actual = set(
+            TimelineEntry.objects.values_list('user', 'recipe').iterator())
+        missing = expected - actual
+        extra = actual - expected
+        for user, recipe in sorted(missing)[:20]:
+            self.stdout.write(
+                f'Пользователь {user}: нет рецепта {recipe} в ленте')
+        for user, recipe in sorted(extra)[:20]:
+            self.stdout.write(
+                f'Пользователь {user}: лишний рецепт {recipe} в ленте')
+        if missing or extra:
+            raise CommandError(
+                f'Расхождений: {len(missing) + len(extra)}.')
+        self.stdout.write('Ленты подписок согласованы.')
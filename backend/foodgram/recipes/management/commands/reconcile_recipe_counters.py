@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """
+    Команда 'reconcile_recipe_counters' пересчитывает счетчики
+    избранного и списков покупок у рецептов.
+    С флагом --verify только сверяет счетчики и ничего не меняет.
+    """
+    help = 'Пересчет счетчиков избранного и списков покупок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только проверить расхождения.'
+        )
+
+    def handle(self, *args, **options):
+        mismatched = Recipe.objects.mismatched_counters()
+        if options['verify']:
+            return self.verify(mismatched)
+        updated = Recipe.objects.filter(
+            pk__in=list(mismatched.values_list('pk', flat=True))
+        ).reconcile_counters()
+        self.stdout.write(f'Исправлено рецептов: {updated}.')
+
+    def verify(self, mismatched):
+        fields = [
+            value for field in Recipe.COUNTERS
+            for value in (field, f'expected_{field}')
+        ]
+        rows = list(mismatched.values_list('pk', *fields)[:20])
+        for pk, *values in rows:
+            self.stdout.write(
+                f'Рецепт {pk}: ' + ', '.join(
+                    f'{field} {actual}, ожидается {expected}'
+                    for field, actual, expected in zip(
+                        Recipe.COUNTERS, values[::2], values[1::2])
+                )
+            )
+        if rows:
+            raise CommandError(f'Расхождений: {mismatched.count()}.')
+        self.stdout.write('Счетчики рецептов согласованы.')
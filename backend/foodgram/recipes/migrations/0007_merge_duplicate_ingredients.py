@@ -0,0 +1,73 @@
+from collections import defaultdict
+
+from django.db import migrations
+from django.db.models import Count, Min, Sum
+from django.utils import timezone
+
+
+def merge_duplicates(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    IngredientAmountRecipe = apps.get_model(
+        'recipes', 'IngredientAmountRecipe')
+    ShoppingCartTotal = apps.get_model('recipes', 'ShoppingCartTotal')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(keep=Min('id'), count=Count('id')).filter(count__gt=1)
+    merged = False
+    for row in duplicates:
+        keep = row['keep']
+        group = Ingredient.objects.filter(
+            name=row['name'], measurement_unit=row['measurement_unit'])
+        # Строки одного рецепта с дублями сливаются в одну строку
+        # с суммой количеств, предпочтительно в строку оставляемого
+        # ингредиента.
+        by_recipe = defaultdict(list)
+        for pk, recipe, ingredient, amount in (
+                IngredientAmountRecipe.objects.filter(
+                    ingredient__in=group
+                ).values_list('id', 'recipe', 'ingredient', 'amount')):
+            by_recipe[recipe].append((ingredient != keep, pk, amount))
+        extra = []
+        kept = {}
+        for recipe, items in by_recipe.items():
+            items.sort()
+            moved, pk, _ = items[0]
+            if moved or len(items) > 1:
+                kept[pk] = sum(amount for _, _, amount in items)
+                extra.extend(pk for _, pk, _ in items[1:])
+        IngredientAmountRecipe.objects.filter(pk__in=extra).delete()
+        for pk, amount in kept.items():
+            IngredientAmountRecipe.objects.filter(pk=pk).update(
+                ingredient_id=keep, amount=amount)
+        Recipe.objects.filter(
+            ingredientamountrecipe__in=kept
+        ).update(updated_at=timezone.now())
+        group.exclude(id=keep).delete()
+        merged = True
+    if not merged:
+        return
+    ShoppingCartTotal.objects.all().delete()
+    rows = IngredientAmountRecipe.objects.filter(
+        recipe__shopping_cart__user__isnull=False
+    ).values(
+        'recipe__shopping_cart__user', 'ingredient'
+    ).annotate(total=Sum('amount')).order_by()
+    ShoppingCartTotal.objects.bulk_create(
+        (ShoppingCartTotal(user_id=row['recipe__shopping_cart__user'],
+                           ingredient_id=row['ingredient'],
+                           total=row['total'])
+         for row in rows.iterator()),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+def fix_invalid_values(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    IngredientAmountRecipe = apps.get_model(
+        'recipes', 'IngredientAmountRecipe')
+    Recipe.objects.filter(cooking_time__lt=1).update(cooking_time=1)
+    IngredientAmountRecipe.objects.filter(amount__lt=1).update(amount=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(fix_invalid_values, migrations.RunPython.noop),
+    ]
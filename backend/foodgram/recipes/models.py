@@ -1,6 +1,122 @@
+from django.conf import settings
 from django.core.validators import MinValueValidator, RegexValidator
-from django.db import models
-from users.models import User
+from django.db import connections, models
+from django.db.models import (Case, Count, Exists, F, OuterRef, Prefetch, Q,
+                              Subquery, Sum, Value, When, Window)
+from django.db.models.functions import Coalesce, Greatest, Lower, RowNumber
+from django.dispatch import Signal
+from users.models import Follow, User
+
+# Отправляется при изменении сумм списков покупок пользователей
+# user_ids; None - пересчитаны списки всех пользователей.
+shopping_totals_changed = Signal()
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Запросы рецептов."""
+
+    def for_feed(self, user):
+        """
+        Рецепты со связанными данными и флагами пользователя
+        за постоянное число запросов.
+        """
+        queryset = self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredientamountrecipe_set',
+                queryset=IngredientAmountRecipe.objects.select_related(
+                    'ingredient')
+            )
+        )
+        if user.is_anonymous:
+            return queryset.annotate(
+                is_favorited=Value(False, models.BooleanField()),
+                is_in_shopping_cart=Value(False, models.BooleanField()),
+                author_is_subscribed=Value(False, models.BooleanField()),
+            )
+        return queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShopingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            author_is_subscribed=Exists(Follow.objects.filter(
+                user=user, following=OuterRef('author'))),
+        )
+
+    def latest_by_authors(self, author_ids, limit=None):
+        """
+        Последние рецепты каждого из авторов одним запросом:
+        не более limit рецептов на автора.
+        """
+        queryset = self.filter(author__in=author_ids)
+        if limit is None:
+            return queryset
+        windowed = queryset.annotate(row_number=Window(
+            expression=RowNumber(),
+            partition_by=F('author'),
+            order_by=(F('created').desc(), F('id').desc()),
+        ))
+        sql, params = windowed.query.sql_with_params()
+        return self.raw(
+            f'SELECT * FROM ({sql}) AS windowed '
+            'WHERE windowed.row_number <= %s '
+            'ORDER BY windowed.row_number',
+            (*params, limit)
+        )
+
+    def not_in_timelines(self, user):
+        """
+        Рецепты авторов из подписок пользователя, которые
+        не разосланы по лентам и добираются при чтении.
+        """
+        return self.filter(
+            fanned_out=False,
+            author__in=Follow.objects.filter(user=user).values('following')
+        )
+
+    def popular(self):
+        """Сначала рецепты, чаще добавляемые в избранное."""
+        return self.order_by('-favorites_count', '-created', '-id')
+
+    def change_counter(self, pk, field, delta):
+        """
+        Атомарно меняет счетчик рецепта на delta, не опуская ниже
+        нуля: строки, добавленные в обход API (админка, shell),
+        счетчик не учитывает, расхождение исправляет
+        reconcile_recipe_counters.
+        """
+        return self.filter(pk=pk).update(
+            **{field: Greatest(F(field) + delta, 0)})
+
+    def with_expected_counters(self):
+        """Счетчики, посчитанные заново по избранному и корзинам."""
+        return self.annotate(**{
+            f'expected_{field}': _count_by_recipe(related)
+            for field, related in Recipe.COUNTERS.items()
+        })
+
+    def mismatched_counters(self):
+        """Рецепты, у которых счетчики разошлись с данными."""
+        return self.with_expected_counters().exclude(**{
+            field: F(f'expected_{field}') for field in Recipe.COUNTERS
+        })
+
+    def reconcile_counters(self):
+        """Пересчитывает счетчики одним запросом."""
+        return self.update(**{
+            field: _count_by_recipe(related)
+            for field, related in Recipe.COUNTERS.items()
+        })
+
+
+def _count_by_recipe(related):
+    model = Recipe._meta.get_field(related).related_model
+    return Coalesce(Subquery(
+        model.objects.filter(
+            recipe=OuterRef('pk'), user__isnull=False
+        ).order_by().values('recipe').annotate(
+            count=Count('id')).values('count')
+    ), 0)
 
 
 class Recipe(models.Model):
@@ -26,32 +142,115 @@ class Recipe(models.Model):
     image = models.ImageField(
         upload_to='recipe/'
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Варианты картинки'
+    )
     text = models.TextField()
     cooking_time = models.IntegerField(
         validators=(MinValueValidator(1),)
     )
     created = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='В избранном'
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='В списках покупок'
+    )
+    fanned_out = models.BooleanField(
+        default=False,
+        editable=False,
+        verbose_name='Разослан по лентам'
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
+    COUNTERS = {
+        'favorites_count': 'favorites',
+        'in_carts_count': 'shopping_cart',
+    }
 
     class Meta:
         ordering = ('-created',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=['-created', '-id'], name='recipe_created_id_idx'
+            ),
+            models.Index(
+                fields=['-favorites_count', '-created', '-id'],
+                name='recipe_popular_idx'
+            ),
+            models.Index(
+                fields=['author', '-created', '-id'],
+                name='recipe_author_created_idx'
+            ),
+            models.Index(
+                fields=['author', '-created', '-id'],
+                condition=Q(fanned_out=False),
+                name='recipe_not_fanned_out_idx'
+            ),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(cooking_time__gte=1),
+                name='recipe_cooking_time_positive'
+            )
+        ]
 
     def __str__(self):
         return self.name
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._saved_image = self._image_name()
+
+    def _image_name(self):
+        value = self.__dict__.get('image')
+        return getattr(value, 'name', value)
+
+    def save(self, *args, **kwargs):
+        """
+        Счетчики меняются только через change_counter, признак
+        рассылки - через ленты, а картинку и ее варианты после
+        загрузки заменяет обработчик картинок, поэтому при сохранении
+        рецепта они не перезаписываются.
+        Новая картинка сбрасывает старые варианты.
+        """
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            skip = {*self.COUNTERS, 'image_variants', 'fanned_out'}
+            if self._image_name() == self._saved_image:
+                skip.add('image')
+            else:
+                self.image_variants = {}
+                skip.discard('image_variants')
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in skip
+            ]
+        super().save(*args, **kwargs)
+        self._saved_image = self._image_name()
+
 
 class Favorite(models.Model):
     """Модель избранных рецептов пользователя."""
     user = models.ForeignKey(
         User,
         null=True,
+        db_index=False,
         on_delete=models.SET_NULL,
         related_name='favorites'
     )
     recipe = models.ForeignKey(
         'Recipe',
         null=True,
+        db_index=False,
         on_delete=models.SET_NULL,
         related_name='favorites'
     )
@@ -64,6 +263,11 @@ class Favorite(models.Model):
                 fields=['user', 'recipe'], name='unique_favorite'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'user'], name='favorite_recipe_user_idx'
+            )
+        ]
 
     def __str__(self) -> str:
         return (
@@ -76,12 +280,14 @@ class ShopingCart(models.Model):
     user = models.ForeignKey(
         User,
         null=True,
+        db_index=False,
         on_delete=models.SET_NULL,
         related_name='shopping_cart'
     )
     recipe = models.ForeignKey(
         'Recipe',
         null=True,
+        db_index=False,
         on_delete=models.SET_NULL,
         related_name='shopping_cart'
     )
@@ -94,6 +300,11 @@ class ShopingCart(models.Model):
                 fields=['user', 'recipe'], name='unique_shopping'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'user'], name='shopping_recipe_user_idx'
+            )
+        ]
 
     def __str__(self) -> str:
         return (
@@ -101,6 +312,257 @@ class ShopingCart(models.Model):
         )
 
 
+# Строк в одном INSERT: 3 параметра на строку, не больше 999 в SQLite.
+UPSERT_BATCH_SIZE = 300
+
+
+class ShoppingCartTotalQuerySet(models.QuerySet):
+    """Запросы суммарного списка покупок."""
+
+    def apply(self, user_ids, amounts):
+        """
+        Прибавляет к суммам пользователей количества ингредиентов
+        amounts вида {id ингредиента: количество}.
+        Каждая сумма меняется одним INSERT ... ON CONFLICT DO UPDATE
+        (PostgreSQL и SQLite 3.24+): строка вставляется или
+        увеличивается атомарно, даже если параллельный запрос
+        только что удалил ее, обнулив сумму. Строки блокируются
+        в одном порядке, чтобы параллельные запросы не
+        взаимоблокировались.
+        """
+        amounts = {
+            ingredient: amount
+            for ingredient, amount in amounts.items() if amount
+        }
+        if not user_ids or not amounts:
+            return
+        rows = sorted(
+            (user, ingredient, amount)
+            for user in set(user_ids)
+            for ingredient, amount in amounts.items()
+        )
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        meta = self.model._meta
+        table = quote(meta.db_table)
+        user, ingredient, total = (
+            quote(meta.get_field(name).column)
+            for name in ('user', 'ingredient', 'total'))
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+                batch = rows[start:start + UPSERT_BATCH_SIZE]
+                cursor.execute(
+                    f'INSERT INTO {table} ({user}, {ingredient}, {total}) '
+                    f'VALUES {", ".join(["(%s, %s, %s)"] * len(batch))} '
+                    f'ON CONFLICT ({user}, {ingredient}) DO UPDATE '
+                    f'SET {total} = {table}.{total} + EXCLUDED.{total}',
+                    [value for row in batch for value in row]
+                )
+        self.filter(
+            user__in=user_ids, ingredient__in=amounts, total__lte=0
+        ).delete()
+        shopping_totals_changed.send(
+            sender=ShoppingCartTotal, user_ids=list(user_ids))
+
+    def add_recipe(self, user_ids, recipe, sign=1):
+        """Учитывает рецепт в списках покупок пользователей."""
+        self.apply(user_ids, {
+            ingredient: sign * amount
+            for ingredient, amount in recipe.ingredientamountrecipe_set
+            .values_list('ingredient', 'amount')
+        })
+
+    def remove_recipe(self, user_ids, recipe):
+        """Убирает рецепт из списков покупок пользователей."""
+        self.add_recipe(user_ids, recipe, sign=-1)
+
+    def change_recipe(self, recipe, old_amounts, new_amounts):
+        """Учитывает изменение количеств ингредиентов рецепта."""
+        self.apply(
+            list(recipe.shopping_cart.exclude(user=None)
+                 .values_list('user', flat=True)),
+            {
+                ingredient: (
+                    new_amounts.get(ingredient, 0)
+                    - old_amounts.get(ingredient, 0)
+                )
+                for ingredient in old_amounts.keys() | new_amounts.keys()
+            }
+        )
+
+    def expected(self):
+        """Суммы, посчитанные заново по спискам покупок."""
+        return IngredientAmountRecipe.objects.filter(
+            recipe__shopping_cart__user__isnull=False
+        ).values(
+            'recipe__shopping_cart__user', 'ingredient'
+        ).annotate(total=Sum('amount')).order_by()
+
+    def rebuild(self):
+        """Пересчитывает таблицу целиком."""
+        self.all().delete()
+        self.bulk_create(
+            (ShoppingCartTotal(user_id=row['recipe__shopping_cart__user'],
+                               ingredient_id=row['ingredient'],
+                               total=row['total'])
+             for row in self.expected().iterator()),
+            batch_size=1000
+        )
+        shopping_totals_changed.send(sender=ShoppingCartTotal, user_ids=None)
+
+
+class TimelineEntryQuerySet(models.QuerySet):
+    """
+    Запросы лент подписок. Новый рецепт сразу записывается
+    в ленты подписчиков автора; рецепты авторов с очень большим
+    числом подписчиков не рассылаются и добираются при чтении.
+    """
+
+    def fan_out(self, recipe):
+        """Добавляет новый рецепт в ленты подписчиков автора."""
+        limit = getattr(settings, 'FEED_FANOUT_MAX_FOLLOWERS', 1000)
+        followers = list(Follow.objects.filter(
+            following=recipe.author_id, user__isnull=False
+        ).values_list('user', flat=True)[:limit + 1])
+        if len(followers) > limit:
+            return False
+        self.bulk_create(
+            (TimelineEntry(user_id=user, recipe=recipe,
+                           author_id=recipe.author_id,
+                           created=recipe.created)
+             for user in followers),
+            batch_size=1000,
+            ignore_conflicts=True
+        )
+        Recipe.objects.filter(pk=recipe.pk).update(fanned_out=True)
+        recipe.fanned_out = True
+        return True
+
+    def backfill(self, user, author):
+        """Последние разосланные рецепты автора в ленту подписчика."""
+        limit = getattr(settings, 'FEED_BACKFILL_LIMIT', 100)
+        recipes = Recipe.objects.filter(
+            author=author, fanned_out=True
+        ).order_by('-created', '-id').values_list('id', 'created')[:limit]
+        self.bulk_create(
+            (TimelineEntry(user=user, recipe_id=recipe, author=author,
+                           created=created)
+             for recipe, created in recipes),
+            ignore_conflicts=True
+        )
+
+    def prune(self, user, author):
+        """Убирает рецепты автора из ленты бывшего подписчика."""
+        return self.filter(user=user, author=author).delete()
+
+    def expected(self):
+        """Записи лент, посчитанные заново по подпискам."""
+        return Recipe.objects.filter(
+            fanned_out=True, author__following__user__isnull=False
+        ).values_list(
+            'author__following__user', 'id', 'author', 'created'
+        ).order_by()
+
+    def rebuild(self):
+        """
+        Заново решает, какие рецепты рассылать, и пересчитывает
+        таблицу целиком.
+        """
+        limit = getattr(settings, 'FEED_FANOUT_MAX_FOLLOWERS', 1000)
+        crowded = Follow.objects.filter(user__isnull=False).values(
+            'following'
+        ).annotate(count=Count('id')).filter(
+            count__gt=limit).values('following')
+        Recipe.objects.exclude(author__in=crowded).update(fanned_out=True)
+        Recipe.objects.filter(author__in=crowded).update(fanned_out=False)
+        self.all().delete()
+        self.bulk_create(
+            (TimelineEntry(user_id=user, recipe_id=recipe,
+                           author_id=author, created=created)
+             for user, recipe, author, created
+             in self.expected().iterator()),
+            batch_size=1000
+        )
+
+
+class TimelineEntry(models.Model):
+    """
+    Рецепт в ленте подписок пользователя.
+    Дата рецепта хранится здесь же, чтобы страница ленты
+    читалась одним проходом по индексу.
+    """
+    user = models.ForeignKey(
+        User,
+        db_index=False,
+        on_delete=models.CASCADE,
+        related_name='timeline'
+    )
+    recipe = models.ForeignKey(
+        'Recipe',
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    created = models.DateTimeField()
+
+    objects = TimelineEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'], name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-created', '-recipe'],
+                name='timeline_user_created_idx'
+            ),
+            models.Index(
+                fields=['user', 'author'], name='timeline_user_author_idx'
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.recipe_id} в ленте пользователя {self.user_id}'
+
+
+class IngredientQuerySet(models.QuerySet):
+    """Запросы ингредиентов."""
+
+    def search(self, value, limit=None):
+        """
+        Поиск по названию одним запросом: сначала совпадения
+        по началу названия, затем по вхождению, а в PostgreSQL
+        еще и похожие по триграммам.
+        """
+        value = value.lower()
+        prefix = Q(lower_name__startswith=value)
+        condition = prefix | Q(lower_name__contains=value)
+        ordering = ('rank', 'name')
+        queryset = self.annotate(lower_name=Lower('name'))
+        if connections[self.db].vendor == 'postgresql':
+            from django.contrib.postgres.search import TrigramSimilarity
+            condition |= Q(lower_name__trigram_similar=value)
+            ordering = ('rank', '-similarity', 'name')
+            queryset = queryset.annotate(
+                similarity=TrigramSimilarity('lower_name', value))
+        queryset = queryset.filter(condition).annotate(rank=Case(
+            When(prefix, then=Value(0)),
+            default=Value(1),
+            output_field=models.IntegerField()
+        )).order_by(*ordering)
+        if limit is not None:
+            return queryset[:limit]
+        return queryset
+
+
 class Ingredient(models.Model):
     """Модель ингредиентов."""
     name = models.CharField(
@@ -112,9 +574,17 @@ class Ingredient(models.Model):
         verbose_name='Единица измерения'
     )
 
+    objects = IngredientQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return self.name
@@ -140,9 +610,48 @@ class IngredientAmountRecipe(models.Model):
             models.UniqueConstraint(
                 fields=['recipe', 'ingredient'],
                 name='unique_recipe'
+            ),
+            models.CheckConstraint(
+                check=models.Q(amount__gte=1),
+                name='amount_positive'
+            ),
+        ]
+
+
+class ShoppingCartTotal(models.Model):
+    """
+    Суммарное количество ингредиента в списке покупок пользователя.
+    Поддерживается при изменении списка покупок и рецептов через API
+    и при удалении рецептов, в том числе вместе с автором.
+    После правки списков покупок или ингредиентов рецептов
+    в админке или shell нужен rebuild_shopping_cart_totals.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_totals'
+    )
+    ingredient = models.ForeignKey(
+        'Ingredient',
+        on_delete=models.CASCADE
+    )
+    total = models.IntegerField()
+
+    objects = ShoppingCartTotalQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Сумма в списке покупок'
+        verbose_name_plural = 'Суммы в списках покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_total'
             )
         ]
 
+    def __str__(self) -> str:
+        return f'{self.user}: {self.ingredient} {self.total}'
+
 
 class Tag(models.Model):
     """Модель тегов."""
@@ -0,0 +1,18 @@
+from django.db import migrations
+from django.db.models import F
+
+
+def delete_self_follows(apps, schema_editor):
+    Follow = apps.get_model('users', 'Follow')
+    Follow.objects.filter(user=F('following')).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_self_follows, migrations.RunPython.noop),
+    ]
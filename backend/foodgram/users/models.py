@@ -22,27 +22,52 @@ class User(AbstractUser):
         verbose_name_plural = 'Пользователи'
 
 
+class FollowQuerySet(models.QuerySet):
+    """Запросы подписок."""
+
+    def for_subscriptions(self, user):
+        """Подписки пользователя с количеством рецептов авторов."""
+        return self.filter(user=user).select_related('following').annotate(
+            recipes_count=models.Count('following__recipes'),
+            is_subscribed=models.Value(True, models.BooleanField()),
+        ).order_by('id')
+
+
 class Follow(models.Model):
     """Модель подписок на авторов."""
     user = models.ForeignKey(
         User,
         null=True,
+        db_index=False,
         on_delete=models.SET_NULL,
         related_name='follower',
     )
     following = models.ForeignKey(
         User,
         null=True,
+        db_index=False,
         on_delete=models.SET_NULL,
         related_name='following'
     )
 
+    objects = FollowQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
         constraints = [
             models.UniqueConstraint(
                 fields=['user', 'following'], name='unique_follow'
+            ),
+            models.CheckConstraint(
+                check=~models.Q(user=models.F('following')),
+                name='prevent_self_follow'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['following', 'user'],
+                name='follow_following_user_idx'
             )
         ]
 